@@ -0,0 +1,283 @@
+"""Standalone benchmark runner for quickAg.
+
+    python benchmarks/bench.py run -o base.json
+    python benchmarks/bench.py run -o new.json -k stream
+    python benchmarks/bench.py compare base.json new.json --threshold 0.1
+
+run times every benchmark whose name contains one of the -k patterns and writes
+the results as JSON. compare prints the ratio of the best times of the second
+run to the first, and exits with status 1 if any benchmark got slower by more
+than the threshold.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from functools import partial
+from itertools import product
+from typing import Any, Callable
+
+try:
+    import quickAg  # noqa: F401
+except ModuleNotFoundError:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from quickAg.math import primes as _primes
+from quickAg.streams import elm, log2, stream
+from quickAg.structs.bags import Bag, Sack
+from quickAg.structs.trees import BinaryTree
+
+# Every benchmark is a setup function returning the callable to time, so that the
+# setup cost stays out of the measure.
+_BENCHES: dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def bench(name: str, **params: tuple[Any, ...]) -> Callable[[Callable[..., Callable[[], Any]]], Any]:
+    """Registers a benchmark, once for every combination of the parameter values."""
+
+    def register(setup: Callable[..., Callable[[], Any]]) -> Callable[..., Callable[[], Any]]:
+        keys = list(params)
+        for vals in product(*params.values()):
+            label = ",".join(f"{k}={v}" for k, v in zip(keys, vals))
+            _BENCHES[f"{name}[{label}]" if label else name] = partial(setup, **dict(zip(keys, vals)))
+        return setup
+
+    return register
+
+
+# Streams
+
+
+def _pipeline(depth: int) -> Any:
+    ss = stream.range(100_000)
+    for i in range(depth):
+        ss = ss.filter(elm % 7 != i % 7) if i % 2 else ss.eval(elm + 1)
+    return ss
+
+
+@bench("stream.pipeline", depth=(1, 3, 6, 12))
+def _stream_pipeline(depth: int) -> Callable[[], Any]:
+    return lambda: _pipeline(depth).null
+
+
+@bench("stream.pipeline_batched", depth=(6,), backend=("python", "numpy"))
+def _stream_batched(depth: int, backend: str) -> Callable[[], Any]:
+    return lambda: _pipeline(depth).batched(1024, backend).null  # type: ignore
+
+
+@bench("stream.robin")
+def _stream_robin() -> Callable[[], Any]:
+    return lambda: stream.robin(stream.range(30_000), stream.range(30_000), stream.range(30_000)).null
+
+
+@bench("stream.zip")
+def _stream_zip() -> Callable[[], Any]:
+    return lambda: stream.zip(stream.range(30_000), stream.range(30_000), stream.range(30_000)).null
+
+
+@bench("stream.cat")
+def _stream_cat() -> Callable[[], Any]:
+    return lambda: stream.cat(stream.range(30_000), stream.range(30_000), stream.range(30_000)).null
+
+
+# Primes
+
+
+@bench("primes.sieve", max=(10**5, 10**6, 10**7))
+def _primes_sieve(max: int) -> Callable[[], Any]:
+    def run() -> int:
+        # The shared table would otherwise answer every run after the first.
+        _primes.cache.clear()
+        return sum(1 for _ in _primes.primes(max))
+
+    return run
+
+
+@bench("primes.is_prime", digits=(7, 13, 19, 39))
+def _primes_is_prime(digits: int) -> Callable[[], Any]:
+    start = 10 ** (digits - 1)
+    nums = range(start + 1, start + 2001, 2)
+    return lambda: sum(map(_primes.is_prime, nums))
+
+
+def _next_prime(n: int) -> int:
+    while not _primes.is_prime(n):
+        n += 1
+    return n
+
+
+@bench("primes.primefac", digits=(12, 18, 24))
+def _primes_primefac(digits: int) -> Callable[[], Any]:
+    # Semiprimes with two factors of half the digits each, the hardest case.
+    half = 10 ** (digits // 2 - 1)
+    nums = [_next_prime(half + 7919 * k) * _next_prime(3 * half + 104729 * k) for k in range(5)]
+    return lambda: [_primes.primefac(n) for n in nums]
+
+
+# Elm
+
+
+@bench("elm.eval", expr=("simple", "deep", "fields"))
+def _elm_eval(expr: str) -> Callable[[], Any]:
+    if expr == "fields":
+        ex: Any = (elm.a + elm.a) * elm.a + elm.b * elm.b
+        data: list[Any] = [{"a": i, "b": i + 1} for i in range(100_000)]
+    else:
+        ex = elm * 2 + 1 > 5
+        if expr == "deep":
+            ex = ((elm * 3 + 1) % 7 - 2) * (elm // 3) + (elm << 2) - (elm & 15) > 10
+        data = list(range(100_000))
+    return lambda: list(map(ex, data))
+
+
+@bench("elm.vectorize", n=(100_000, 1_000_000))
+def _elm_vectorize(n: int) -> Callable[[], Any]:
+    ex = log2(elm + 1) * 3 - elm * elm > 1
+    data = [i / n for i in range(n)]
+    try:
+        import numpy as np
+
+        arr: Any = np.asarray(data)
+    except ModuleNotFoundError:
+        arr = data
+    return lambda: ex.vectorize(arr)
+
+
+# Containers
+
+
+@bench("bags.append", cls=("Bag", "Sack"))
+def _bags_append(cls: str) -> Callable[[], Any]:
+    kind = Bag if cls == "Bag" else Sack
+
+    def run() -> Any:
+        bag: Any = kind()
+        for i in range(100_000):
+            bag.append(i % 1000, i)
+        return bag
+
+    return run
+
+
+@bench("bags.lookup", cls=("Bag", "Sack"))
+def _bags_lookup(cls: str) -> Callable[[], Any]:
+    bag: Any = Bag() if cls == "Bag" else Sack()
+    bag.extend((i % 1000, i) for i in range(100_000))
+    return lambda: [bag[k] for k in range(2000)]
+
+
+@bench("trees.insert", n=(200, 1000))
+def _trees_insert(n: int) -> Callable[[], Any]:
+    def run() -> Any:
+        tree: BinaryTree[int] = BinaryTree()
+        for i in range(n):
+            tree.insert(i)
+        return tree
+
+    return run
+
+
+def _timed(func: Callable[[], Any], repeat: int, target: float) -> dict[str, Any]:
+    # The number of calls per repeat grows until a repeat takes at least target
+    # seconds, as in timeit.autorange; the times are per call.
+    number = 1
+    while True:
+        t = time.perf_counter()
+        for _ in range(number):
+            func()
+        dt = time.perf_counter() - t
+        if dt >= target:
+            break
+        number *= 2 if dt < target / 8 else 1 + int(target / max(dt, 1e-9))
+    times = [dt / number]
+    for _ in range(repeat - 1):
+        t = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - t) / number)
+    return {"best": min(times), "median": statistics.median(times), "number": number, "repeat": repeat}
+
+
+def run(patterns: list[str], repeat: int, target: float) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    for name, setup in _BENCHES.items():
+        if patterns and not any(p in name for p in patterns):
+            continue
+        res = _timed(setup(), repeat, target)
+        results[name] = res
+        print(f"{name:45} {res['best'] * 1e3:12.4f} ms  (x{res['number']})", flush=True)
+    return {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def compare(base: dict[str, Any], new: dict[str, Any], threshold: float) -> list[str]:
+    """Prints the ratio of the best times of the benchmarks in both runs, and
+    returns the names of those slower by more than the threshold."""
+    slower = []
+    print(f"{'benchmark':45} {'base ms':>12} {'new ms':>12} {'ratio':>7}")
+    for name, res in new["results"].items():
+        if name not in base["results"]:
+            continue
+        b, n = base["results"][name]["best"], res["best"]
+        ratio = n / b
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            slower.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = "  faster"
+        print(f"{name:45} {b * 1e3:12.4f} {n * 1e3:12.4f} {ratio:7.2f}{flag}")
+    return slower
+
+
+def _main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python benchmarks/bench.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("run", help="run the benchmarks and save the results as JSON")
+    cmd.add_argument("-o", "--out", default=None, help="the JSON file to write")
+    cmd.add_argument("-k", dest="patterns", action="append", default=[], help="only run the matching benchmarks")
+    cmd.add_argument("--repeat", type=int, default=5)
+    cmd.add_argument("--target", type=float, default=0.2, help="minimum seconds per repeat")
+    cmd = sub.add_parser("compare", help="compare two saved runs and flag the regressions")
+    cmd.add_argument("base")
+    cmd.add_argument("new")
+    cmd.add_argument("--threshold", type=float, default=0.1, help="relative slowdown flagged as a regression")
+    cmd = sub.add_parser("list", help="list the benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        print("\n".join(_BENCHES))
+        return 0
+    if args.command == "run":
+        res = run(args.patterns, args.repeat, args.target)
+        if args.out is not None:
+            with open(args.out, "w") as f:
+                json.dump(res, f, indent=2)
+        return 0
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    slower = compare(base, new, args.threshold)
+    if slower:
+        print(f"{len(slower)} regression(s) above {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
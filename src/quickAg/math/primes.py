@@ -1,52 +1,721 @@
-from itertools import count
-from math import sqrt
-from typing import Iterator
+from __future__ import annotations
 
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from itertools import compress, islice, takewhile
+from math import gcd, isqrt, log
+from typing import TYPE_CHECKING, Any, Iterable, Iterator
 
-def _quasiprimes_count() -> Iterator[int]:
-    yield 2
-    yield 3
-    for i in count(6, 6):
-        yield i - 1
-        yield i + 1
+if TYPE_CHECKING:
+    from concurrent.futures import Future
 
 
-def _quasiprimes(max: int) -> Iterator[int]:
-    for q in _quasiprimes_count():
-        if q >= max:
-            break
-        yield q
+def _sprp(n: int, a: int) -> bool:
+    # Strong probable prime test of the odd number n to base a.
+    d = n - 1
+    s = (d & -d).bit_length() - 1
+    d >>= s
+    x = pow(a, d, n)
+    if x == 1 or x == n - 1:
+        return True
+    for _ in range(s - 1):
+        x = x * x % n
+        if x == n - 1:
+            return True
+    return False
+
+
+def _jacobi(a: int, n: int) -> int:
+    a %= n
+    r = 1
+    while a:
+        while not a & 1:
+            a >>= 1
+            if n & 7 in (3, 5):
+                r = -r
+        a, n = n, a
+        if a & 3 == 3 and n & 3 == 3:
+            r = -r
+        a %= n
+    return r if n == 1 else 0
+
+
+def _slprp(n: int) -> bool:
+    # Strong Lucas probable prime test of the odd non square n, with the
+    # parameters chosen by Selfridge's method A.
+    D = 5
+    while (j := _jacobi(D, n)) != -1:
+        if j == 0 and abs(D) != n:
+            return False
+        D = -D - 2 if D > 0 else -D + 2
+    P, Q = 1, (1 - D) // 4
+    s = ((n + 1) & -(n + 1)).bit_length() - 1
+    d = (n + 1) >> s
+    U, V, Qk = 1, P, Q % n
+    for bit in bin(d)[3:]:
+        U, V, Qk = U * V % n, (V * V - 2 * Qk) % n, Qk * Qk % n
+        if bit == "1":
+            U, V = P * U + V, D * U + P * V
+            U = (U + n if U & 1 else U) >> 1
+            V = (V + n if V & 1 else V) >> 1
+            U, V, Qk = U % n, V % n, Qk * Q % n
+    if U == 0 or V == 0:
+        return True
+    for _ in range(s - 1):
+        V, Qk = (V * V - 2 * Qk) % n, Qk * Qk % n
+        if V == 0:
+            return True
+    return False
 
 
 def is_prime(n: int) -> bool:
+    """Exact primality test. Small numbers are looked up or trial divided, larger
+    ones go through Miller-Rabin with a set of bases known to be deterministic
+    below 3.3e24, and beyond that through the Baillie-PSW test, for which no
+    counterexample is known. Integral floats are tested as the int they are
+    equal to, and other non-integral numbers are not primes."""
+    if n.__class__ is not int and not isinstance(n, int):
+        if n != int(n):
+            return False
+        n = int(n)
     if n < 2:
         return False
     if n in _s1000:
         return True
-    return all(n % i != 0 for i in _quasiprimes(int(sqrt(n))))
+    if (f := _file) is not None and n < f.limit:
+        return n in f
+    table, limit = cache.snapshot()
+    if n < limit:
+        i = bisect_left(table, n)
+        return i < len(table) and table[i] == n
+    for p in _t1000[:_PREFILTER]:
+        if n % p == 0:
+            return False
+    if n < _TRIAL:
+        for p in _t1000[_PREFILTER:]:
+            if p * p > n:
+                return True
+            if n % p == 0:
+                return False
+        return True
+    for bound, bases in _MR_BASES:
+        if n < bound:
+            return all(_sprp(n, a) for a in bases)
+    if isqrt(n) ** 2 == n:
+        return False
+    return _sprp(n, 2) and _slprp(n)
+
+
+def _simple(max: int) -> tuple[int, ...]:
+    sieve = bytearray([1]) * (max // 2)
+    sieve[0] = 0
+    for i in range(1, (isqrt(max - 1) - 1) // 2 + 1):
+        if sieve[i]:
+            p = 2 * i + 1
+            sieve[p * p // 2 :: p] = bytes(len(range(p * p // 2, len(sieve), p)))
+    return tuple(compress(range(1, max, 2), sieve))
+
+
+def _base() -> Iterator[int]:
+    # Odd sieving primes in order: past the precomputed table they come from a
+    # nested sieve, which only needs the table itself up to _SMALL ** 2.
+    yield from _small
+    yield from _sieve(_SMALL + 1, None)
+
+
+def _sieve(lo: int, hi: int | None) -> Iterator[int]:
+    # Segmented sieve over the odd numbers in [lo, hi), with lo odd. Each segment
+    # holds one byte per odd number, and only the primes up to the square root of
+    # the segment end are kept, so the memory grows as sqrt(hi).
+    base = _base()
+    sp: list[int] = []
+    nxt = next(base)
+    while hi is None or lo < hi:
+        top = lo + 2 * _SEGMENT if hi is None else min(lo + 2 * _SEGMENT, hi)
+        while nxt * nxt < top:
+            sp.append(nxt)
+            nxt = next(base)
+        yield from compress(range(lo, top, 2), _segment(lo, top, sp))
+        lo += 2 * _SEGMENT
+
+
+def _segment(lo: int, hi: int, sp: Iterable[int]) -> bytearray:
+    # One byte per odd number in [lo, hi), with lo odd, set for the numbers with no
+    # factor among the odd sieving primes sp, which must reach up to sqrt(hi).
+    size = (hi - lo + 1) // 2
+    seg = bytearray([1]) * size
+    for p in sp:
+        m = max(p * p, -(-lo // p) * p)
+        if not m & 1:
+            m += p
+        i = (m - lo) // 2
+        seg[i::p] = bytes(len(range(i, size, p)))
+    if lo == 1 and size:
+        seg[0] = 0
+    return seg
+
+
+class PrimeTable:
+    """Process wide table of all the primes below limit, stored as an array of
+    unsigned 32 bit integers. The table grows as primes() and reserve() request
+    more primes, up to maxbytes of memory and to the primes below 2**32. The
+    table and its limit are replaced together, so readers that take a snapshot
+    see a consistent pair even while another thread extends or clears it."""
+
+    def __init__(self, maxbytes: int = 64 << 20) -> None:
+        self.maxbytes = maxbytes
+        self._lock = threading.Lock()
+        self._state = (array("I"), 2)
+
+    @property
+    def limit(self) -> int:
+        return self._state[1]
+
+    def snapshot(self) -> tuple[array, int]:
+        """Returns the table and the limit below which it holds every prime. The
+        table may grow past the limit afterwards, but never changes below it."""
+        return self._state
+
+    def reserve(self, n: int) -> bool:
+        """Extends the table to every prime below n. Returns False if the table
+        stopped short of n because of the memory ceiling or of the 32 bit range."""
+        with self._lock:
+            table, limit = self._state
+            if n <= limit:
+                return True
+            top = min(n, _TABLE_MAX)
+            room = self.maxbytes // table.itemsize - len(table)
+            if room <= 0:
+                return False
+            if limit == 2:
+                table.append(2)
+                limit, room = 3, room - 1
+            new = array("I", islice(_sieve(limit | 1, top), room))
+            full = len(new) == room
+            table.extend(new)
+            if full:
+                # The sieve may have been cut short: the table is exact up to the
+                # last prime it holds.
+                self._state = table, table[-1] + 1 if table else 2
+                return False
+            self._state = table, top
+            return top == n
+
+    def clear(self) -> None:
+        """Releases the memory held by the table."""
+        with self._lock:
+            self._state = array("I"), 2
+
+    def __contains__(self, n: int) -> bool:
+        # Only meaningful below limit.
+        table = self._state[0]
+        i = bisect_left(table, n)
+        return i < len(table) and table[i] == n
+
+    def __len__(self) -> int:
+        return len(self._state[0])
+
+    def _chunk(self, pos: int) -> array:
+        with self._lock:
+            return self._state[0][pos : pos + _TABLE_CHUNK]
+
+    @property
+    def nbytes(self) -> int:
+        table = self._state[0]
+        return len(table) * table.itemsize
+
+
+def primes(max: int | None = None, workers: int | None = None) -> Iterator[int]:
+    """Yields the prime numbers in order, up to max excluded, or forever if max
+    is None. The primes are read from the loaded prime file if any, or else from
+    the shared table, which is extended with a segmented sieve of Eratosthenes;
+    past the table ceiling they are sieved without being stored. With more than
+    one worker and a max past the loaded file that spans more than one segment
+    per worker, the segments are instead sieved in a pool of worker processes,
+    bypassing the shared table."""
+    if workers is not None and workers < 1:
+        raise ValueError("The number of workers must be at least 1")
+    if workers is not None and workers > 1 and max is None:
+        raise ValueError("Sieving in parallel requires a max")
+    if max is not None and max <= 2:
+        return
+    f = _file
+    # The pool only pays off once every worker has at least one whole segment.
+    pooled = workers is not None and workers > 1 and max > 2 * _PSEGMENT * workers  # type: ignore
+    if pooled and (f is None or max > f.limit):  # type: ignore
+        yield 2
+        yield from _psieve(3, max, workers)  # type: ignore
+        return
+    if f is not None:
+        yield from f.primes(0, max)
+        if max is None or max > f.limit:
+            yield from _sieve(f.limit | 1, max)
+        return
+    pos, last = 0, 1
+    while True:
+        chunk = cache._chunk(pos)
+        if not chunk:
+            # The table is exhausted: the following primes are all past its limit.
+            # It is extended by at most _LOOKAHEAD numbers at a time, so that the
+            # consumer does not wait for primes it may never ask for.
+            limit = cache.limit
+            top = min(2 * limit + _SEGMENT, limit + _LOOKAHEAD)
+            cache.reserve(top if max is None else min(max, top))
+            if len(cache) > pos:
+                continue
+            if max is not None and cache.limit >= max:
+                return
+            break
+        if max is not None and chunk[-1] >= max:
+            yield from takewhile(lambda p: p < max, chunk)
+            return
+        yield from chunk
+        pos += len(chunk)
+        last = chunk[-1]
+    if last < 2:
+        yield 2
+    yield from _sieve(last + 2 if last > 2 else 3, max)
+
+
+def _initworker(sp: array) -> None:
+    global _worker_base
+    _worker_base = sp
+
+
+def _segprimes(lo: int, hi: int) -> array:
+    # Runs in the workers, with the sieving primes set by _initworker.
+    sp = _worker_base[: bisect_right(_worker_base, isqrt(hi - 1))]
+    return array("Q", compress(range(lo, hi, 2), _segment(lo, hi, sp)))
+
+
+def _psieve(lo: int, hi: int, workers: int) -> Iterator[int]:
+    # Segmented sieve over the odd numbers in [lo, hi), with lo odd, in a process
+    # pool: the odd sieving primes are computed once and sent to each worker, and
+    # at most two segments per worker are in flight, yielded back in order.
+    from concurrent.futures import ProcessPoolExecutor
+
+    sp = array("Q", islice(primes(isqrt(hi - 1) + 1), 1, None))
+    step = 2 * _PSEGMENT
+    bounds = ((a, min(a + step, hi)) for a in range(lo, hi, step))
+    ex = ProcessPoolExecutor(workers, initializer=_initworker, initargs=(sp,))
+    pending: deque[Future[array]] = deque()
+    try:
+        for a, b in bounds:
+            pending.append(ex.submit(_segprimes, a, b))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for fut in pending:
+            fut.cancel()
+        ex.shutdown(wait=False, cancel_futures=True)
+
+
+def _sieves(lo: int, hi: int, n: int) -> bool:
+    # Sieving costs about as much per sieving prime as is_prime per value, so the
+    # n values in [lo, hi] are sieved only when they are dense in their range and
+    # need no more sieving primes than there are values, all in the small table.
+    return hi - lo <= _DENSE * n and hi < _SMALL * _SMALL and bisect_right(_small, isqrt(hi)) <= n
+
+
+def _dense(lo: int, hi: int) -> tuple[int, bytearray]:
+    # One byte per odd number of [start, hi], sieved in one go.
+    start = max(lo, 2) | 1
+    return start, _segment(start, hi + 1, _small[: bisect_right(_small, isqrt(hi))])
+
+
+def is_prime_many(values: Any) -> Any:
+    """Tests the primality of every int of a sequence, returning a list of bools,
+    or a boolean mask for a NumPy integer array. When the values are dense in
+    their range, and small enough for the sieve to be cheaper than the tests, the
+    whole range is sieved once, otherwise each value goes through is_prime."""
+    if hasattr(values, "dtype") and hasattr(values, "tolist"):
+        return _is_prime_array(values)
+    vals = list(values)
+    if not vals:
+        return []
+    if not all(v.__class__ is int for v in vals) or not _sieves(min(vals), max(vals), len(vals)):
+        return list(map(is_prime, vals))
+    start, seg = _dense(min(vals), max(vals))
+    return [v == 2 or v > 2 and v & 1 == 1 and seg[(v - start) >> 1] == 1 for v in vals]
+
+
+def _is_prime_array(values: Any) -> Any:
+    import numpy as np
+
+    lo, hi = (int(values.min()), int(values.max())) if values.size else (0, 0)
+    if values.dtype.kind not in "iu" or not _sieves(lo, hi, values.size):
+        return np.array(list(map(is_prime, values.tolist())), dtype=bool).reshape(values.shape)
+    start, seg = _dense(lo, hi)
+    v = values.astype(np.int64)
+    mask = v == 2
+    odd = (v > 2) & (v & 1 == 1)
+    mask[odd] = np.frombuffer(seg, np.uint8)[(v[odd] - start) >> 1] == 1
+    return mask
+
+
+def _iroot(n: int, k: int) -> int:
+    # Integer k-th root, rounded down, by Newton's method.
+    x = 1 << -(-n.bit_length() // k)
+    while True:
+        y = ((k - 1) * x + n // x ** (k - 1)) // k
+        if y >= x:
+            return x
+        x = y
+
+
+def _brent(n: int, c: int, limit: int) -> int:
+    # Pollard's rho with Brent's cycle detection, batching the gcd over m steps.
+    # Returns n when the sequence collapses or the step limit is hit.
+    y, r, q, g, m = 2, 1, 1, 1, 128
+    x = ys = y
+    while g == 1:
+        x = y
+        for _ in range(r):
+            y = (y * y + c) % n
+        k = 0
+        while k < r and g == 1:
+            ys = y
+            for _ in range(min(m, r - k)):
+                y = (y * y + c) % n
+                q = q * abs(x - y) % n
+            g = gcd(q, n)
+            k += m
+        r <<= 1
+        if r > limit:
+            return n
+    if g == n:
+        while True:
+            ys = (ys * ys + c) % n
+            g = gcd(abs(x - ys), n)
+            if g > 1:
+                return g
+    return g
+
+
+def _ecm_add(P: tuple[int, int], Q: tuple[int, int], D: tuple[int, int], n: int) -> tuple[int, int]:
+    # Differential addition on a Montgomery curve in X:Z coordinates, D = P - Q.
+    u = (P[0] - P[1]) * (Q[0] + Q[1])
+    v = (P[0] + P[1]) * (Q[0] - Q[1])
+    return D[1] * (u + v) ** 2 % n, D[0] * (u - v) ** 2 % n
 
 
-def primes(max: int | None = None) -> Iterator[int]:
-    if max is None:
-        _qp = _quasiprimes_count()
-    else:
-        _qp = _quasiprimes(max)
-    for q in _qp:
-        if is_prime(q):
-            yield q
+def _ecm_double(P: tuple[int, int], a24: int, n: int) -> tuple[int, int]:
+    s = (P[0] + P[1]) ** 2 % n
+    d = (P[0] - P[1]) ** 2 % n
+    t = s - d
+    return s * d % n, t * (d + a24 * t) % n
+
+
+def _ecm_mul(k: int, P: tuple[int, int], a24: int, n: int) -> tuple[int, int]:
+    R0, R1 = P, _ecm_double(P, a24, n)
+    for bit in bin(k)[3:]:
+        if bit == "1":
+            R0, R1 = _ecm_add(R1, R0, P, n), _ecm_double(R1, a24, n)
+        else:
+            R0, R1 = _ecm_double(R0, a24, n), _ecm_add(R1, R0, P, n)
+    return R0
+
+
+def _ecm(n: int, B1: int, sigma: int) -> int:
+    # One curve of Lenstra's elliptic curve method, with Suyama's parametrization,
+    # a stage 1 up to B1 and a stage 2 over the primes up to 50 * B1. Returns n
+    # or 1 when the curve finds no factor.
+    u, v = (sigma * sigma - 5) % n, 4 * sigma % n
+    try:
+        inv = pow(16 * u**3 * v, -1, n)
+    except ValueError:
+        return gcd(16 * u**3 * v, n)
+    a24 = (v - u) ** 3 * (3 * u + v) * inv % n
+    Q = (u**3 % n, v**3 % n)
+    for p in primes(B1 + 1):
+        pk = p
+        while pk * p <= B1:
+            pk *= p
+        Q = _ecm_mul(pk, Q, a24, n)
+    g = gcd(Q[1], n)
+    if g != 1:
+        return g
+    # Odd multiples kQ are stepped by 2Q, accumulating Z(kQ) for prime k.
+    Q2 = _ecm_double(Q, a24, n)
+    k = B1 | 1
+    prev, R = _ecm_mul(k - 2, Q, a24, n), _ecm_mul(k, Q, a24, n)
+    acc = 1
+    for j, isp in enumerate(_isprime_range(k, 50 * B1)):
+        if isp:
+            acc = acc * R[1] % n
+        if j & 255 == 255 and gcd(acc, n) != 1:
+            break
+        prev, R = R, _ecm_add(R, Q2, prev, n)
+    return gcd(acc, n)
+
+
+def _isprime_range(lo: int, hi: int) -> Iterator[bool]:
+    # Primality flags of the odd numbers in [lo, hi), with lo odd.
+    flags = dict.fromkeys(_sieve(lo, hi), True)
+    return (k in flags for k in range(lo, hi, 2))
+
+
+def _factor(n: int) -> int:
+    # Returns a non trivial factor of the composite n, which has no factor below
+    # the trial division bound.
+    r = isqrt(n)
+    if r * r == n:
+        return r
+    for k in range(3, n.bit_length() // _TRIALDIV.bit_length() + 1):
+        r = _iroot(n, k)
+        if r**k == n:
+            return r
+    for c in range(1, 4):
+        d = _brent(n, c, _RHO_LIMIT)
+        if d != n:
+            return d
+    B1, sigma = 2000, 6
+    while True:
+        for _ in range(_ECM_CURVES):
+            d = _ecm(n, B1, sigma)
+            sigma += 1
+            if d != n and d != 1:
+                return d
+        B1 *= 5
+
+
+def _factors(n: int, out: list[int]) -> None:
+    if n < _TRIALDIV * _TRIALDIV or is_prime(n):
+        out.append(n)
+        return
+    d = _factor(n)
+    _factors(d, out)
+    _factors(n // d, out)
 
 
 def primefac(n: int) -> list[int]:
+    """Returns the prime factors of n in ascending order, with multiplicity and
+    preceded by 1. Small factors are found by trial division, and the cofactors
+    that are not prime are split by Pollard-Brent rho and, for the factors that
+    rho cannot find quickly, by Lenstra's elliptic curve method."""
     r = [1]
-    for p in primes(n):
+    if n < 2:
+        if n != 1:
+            r.append(n)
+        return r
+    for p in _trial:
+        if p * p > n:
+            break
         while n % p == 0:
             r.append(p)
-            n = n // p
+            n //= p
+    big: list[int] = []
     if n != 1:
-        r.append(n)
+        _factors(n, big)
+    r.extend(sorted(big))
     return r
 
 
+def primefac_dict(n: int) -> dict[int, int]:
+    """Returns the prime factorization of n as a dictionary from every prime
+    factor to its multiplicity, in ascending order. The leading 1 of primefac is
+    not included."""
+    return dict(Counter(primefac(n)[1:]))
+
+
+def primepi(x: int) -> int:
+    """Returns the number of primes up to x included. Below the range of the
+    loaded prime file or of the shared table the primes are counted there,
+    otherwise with the Lucy_Hedgehog method, in about O(x ** (3/4)) time and
+    O(sqrt(x)) memory."""
+    x = int(x)
+    if x < 2:
+        return 0
+    if (f := _file) is not None and x < f.limit:
+        return f.count(0, x + 1)
+    table, limit = cache.snapshot()
+    if x < limit:
+        return bisect_right(table, x)
+    # small[v] counts the numbers in [2, v] and large[i] those in [2, x // i] that
+    # survive the sieving by the primes below p, until p reaches sqrt(x).
+    r = isqrt(x)
+    small = [v - 1 for v in range(r + 1)]
+    large = [0] + [x // i - 1 for i in range(1, r + 1)]
+    for p in range(2, r + 1):
+        if small[p] == small[p - 1]:
+            continue
+        sp = small[p - 1]
+        p2 = p * p
+        top = min(r, x // p2)
+        mid = min(top, r // p)
+        large[1 : mid + 1] = [large[i] - large[i * p] + sp for i in range(1, mid + 1)]
+        large[mid + 1 : top + 1] = [large[i] - small[x // (i * p)] + sp for i in range(mid + 1, top + 1)]
+        if p2 <= r:
+            small[p2:] = [small[v] - small[v // p] + sp for v in range(p2, r + 1)]
+    return large[1]
+
+
+def nth_prime(n: int) -> int:
+    """Returns the n-th prime, starting from nth_prime(1) == 2. The prime is found
+    by counting the primes up to a lower bound of its value with primepi, and
+    sieving from there."""
+    if n < 1:
+        raise ValueError("n must be at least 1")
+    table = cache.snapshot()[0]
+    if n <= len(table):
+        return table[n - 1]
+    if n < 6:
+        return (2, 3, 5, 7, 11)[n - 1]
+    # p_n > n * (ln n + ln ln n - 1) for every n >= 2 (Dusart, 1999).
+    lo = int(n * (log(n) + log(log(n)) - 1))
+    c = primepi(lo)
+    for p in _sieve(lo + 1 | 1, None):
+        c += 1
+        if c == n:
+            return p
+    raise AssertionError  # pragma: no cover
+
+
+class PrimeFile:
+    """Read only view of a prime table file written by build(). The file holds a
+    header followed by one bit for every odd number below limit, set for the
+    primes, and is memory mapped, so that lookups and iteration read it in place
+    and the pages are shared between the processes using the same file."""
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        import mmap
+
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.limit = struct.unpack_from(_HEADER, self._mm)
+        if magic != _MAGIC or len(self._mm) != _HEADERSIZE + _packedsize(self.limit):
+            self._mm.close()
+            raise ValueError(f"{path} is not a prime table file")
+        self._bits = memoryview(self._mm)[_HEADERSIZE:]
+
+    def __contains__(self, n: int) -> bool:
+        if not 0 <= n < self.limit:
+            raise ValueError(f"{n} is outside of the table range [0, {self.limit})")
+        if not n & 1:
+            return n == 2
+        i = n >> 1
+        return bool(self._bits[i >> 3] >> (i & 7) & 1)
+
+    def primes(self, lo: int = 0, hi: int | None = None) -> Iterator[int]:
+        """Yields the primes in [lo, hi), clipped to the range of the table."""
+        hi = self.limit if hi is None else min(hi, self.limit)
+        if lo <= 2 < hi:
+            yield 2
+        first, last = max(lo, 0) >> 4, (hi + 15) >> 4
+        for j in range(first, last, _FILE_CHUNK):
+            k = min(j + _FILE_CHUNK, last)
+            edge = j == first or k == last
+            for b, byte in enumerate(self._bits[j:k], j):
+                if byte:
+                    base = 16 * b + 1
+                    for d in _BITOFFSETS[byte]:
+                        p = base + d
+                        if not edge or lo <= p < hi and p > 1:
+                            yield p
+
+    def count(self, lo: int = 0, hi: int | None = None) -> int:
+        """Counts the primes in [lo, hi), clipped to the range of the table."""
+        hi = self.limit if hi is None else min(hi, self.limit)
+        lo = max(lo, 0)
+        if lo >= hi:
+            return 0
+        # Bit i stands for 2i + 1: the odd numbers in [lo, hi) are the bits in
+        # [lo // 2, hi // 2), counted a chunk of whole bytes at a time and masked
+        # at the edges.
+        a, b = lo >> 1, hi >> 1
+        n = int(lo <= 2 < hi)
+        for j in range(a >> 3, (b + 7) >> 3, _FILE_CHUNK):
+            k = min(j + _FILE_CHUNK, (b + 7) >> 3)
+            x = int.from_bytes(self._bits[j:k], "little")
+            first, last = max(a - 8 * j, 0), min(b - 8 * j, 8 * (k - j))
+            n += (x >> first & (1 << (last - first)) - 1).bit_count()
+        return n
+
+    def close(self) -> None:
+        self._bits.release()
+        self._mm.close()
+
+    def __enter__(self) -> PrimeFile:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def _packedsize(limit: int) -> int:
+    return (limit // 2 + 7) // 8
+
+
+def _packed(lo: int, hi: int) -> bytes:
+    # Sieves the odd numbers in [lo, hi), with lo a multiple of 16, and packs them
+    # into bits, eight odd numbers per byte.
+    flags = _segment(lo + 1, hi, islice(primes(isqrt(hi) + 1), 1, None))
+    if len(flags) & 7:
+        flags.extend(bytes(8 - (len(flags) & 7)))
+    acc = 0
+    for k in range(8):
+        acc |= int.from_bytes(flags[k::8].translate(_SHIFTS[k]), "little")
+    return acc.to_bytes(len(flags) // 8, "little")
+
+
+def build(limit: int, path: str | os.PathLike[str], workers: int | None = None) -> None:
+    """Writes the table of the primes below limit to path, sieving the segments
+    in parallel in a pool of worker processes."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not 2 <= limit <= _FILE_MAX:
+        raise ValueError(f"The limit must be between 2 and {_FILE_MAX}")
+    step = 16 * _FILE_SEGMENT
+    bounds = [(lo, min(lo + step, limit)) for lo in range(0, limit, step)]
+    with open(path, "wb") as f, ProcessPoolExecutor(workers) as ex:
+        f.write(struct.pack(_HEADER, _MAGIC, limit))
+        for chunk in ex.map(_packed, *zip(*bounds)):
+            f.write(chunk)
+        f.truncate(_HEADERSIZE + _packedsize(limit))
+
+
+def load(path: str | os.PathLike[str]) -> PrimeFile:
+    """Opens a prime table file and makes primes() and is_prime() read from it
+    below its limit. The previously loaded file, if any, is replaced and closed."""
+    global _file
+    f = PrimeFile(path)
+    old, _file = _file, f
+    if old is not None:
+        old.close()
+    return f
+
+
+def unload() -> None:
+    """Stops primes() and is_prime() from reading the loaded file, and closes it."""
+    global _file
+    old, _file = _file, None
+    if old is not None:
+        old.close()
+
+
+def _main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m quickAg.math.primes")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("build", help="write a bit-packed table of the primes below a limit")
+    cmd.add_argument("--limit", type=lambda x: int(float(x)), required=True)
+    cmd.add_argument("--workers", type=int, default=None)
+    cmd.add_argument("out")
+    args = parser.parse_args(argv)
+    build(args.limit, args.out, args.workers)
+    with PrimeFile(args.out) as f:
+        print(f"{args.out}: {f.count()} primes below {f.limit}")
+    return 0
+
+
 _t1000 = (
     2,
     3,
@@ -601,3 +1270,71 @@ _t1000 = (
     4001,
 )
 _s1000 = frozenset(_t1000)
+
+# Trial division by the first primes rejects most composites before any modular
+# exponentiation, and the whole table decides every n below _TRIAL exactly.
+_PREFILTER = 30
+_TRIAL = _t1000[-1] ** 2
+# Smallest strong pseudoprime to all the given prime bases (OEIS A014233): below
+# it the bases form a deterministic test.
+_MR_BASES: tuple[tuple[int, tuple[int, ...]], ...] = (
+    (2047, (2,)),
+    (1373653, (2, 3)),
+    (25326001, (2, 3, 5)),
+    (3215031751, (2, 3, 5, 7)),
+    (2152302898747, (2, 3, 5, 7, 11)),
+    (3474749660383, (2, 3, 5, 7, 11, 13)),
+    (341550071728321, (2, 3, 5, 7, 11, 13, 17)),
+    (3825123056546413051, (2, 3, 5, 7, 11, 13, 17, 19, 23)),
+    (318665857834031151167461, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)),
+    (3317044064679887385961981, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)),
+)
+
+# Odd numbers per sieve segment: one byte each, so a segment fits in the L2 cache.
+_SEGMENT = 1 << 17
+# Odd numbers per segment when sieving in a process pool: larger than _SEGMENT to
+# amortize the transfer of each segment back to the caller.
+_PSEGMENT = 1 << 20
+_worker_base = array("Q")
+# The odd primes below _SMALL are precomputed, enough to sieve up to _SMALL ** 2.
+_SMALL = 1 << 16
+_small = _simple(_SMALL)
+
+# The shared table holds 32 bit primes, and is read by the generators a chunk at a
+# time, so that it can grow while they run, by at most _LOOKAHEAD numbers at a
+# time.
+_TABLE_MAX = 1 << 32
+_TABLE_CHUNK = 1 << 12
+_LOOKAHEAD = 1 << 22
+cache = PrimeTable()
+
+# is_prime_many sieves the range of the values when it spans at most _DENSE
+# numbers per value, as sieving a number costs a small fraction of a test.
+_DENSE = 64
+
+# Factorization: trial division by the primes below _TRIALDIV, after which any
+# cofactor below its square is prime. Rho gives up after _RHO_LIMIT steps, which
+# finds factors up to about 10 digits, and ECM then tries _ECM_CURVES curves for
+# every bound.
+_TRIALDIV = 1 << 12
+_trial = (2, *(p for p in _small if p < _TRIALDIV))
+_RHO_LIMIT = 1 << 16
+_ECM_CURVES = 8
+
+# Prime table files: a header with a magic string and the limit, then the bits of
+# the odd numbers, least significant bit first. _BITOFFSETS[b] lists the offsets
+# from the first odd number of a byte of value b to its primes. A table up to
+# _FILE_MAX takes 64 GiB.
+_MAGIC = b"QAGPRIME"
+_HEADER = "<8sQ"
+_HEADERSIZE = struct.calcsize(_HEADER)
+_FILE_MAX = 1 << 40
+_FILE_SEGMENT = 1 << 16
+_FILE_CHUNK = 1 << 16
+_BITOFFSETS = tuple(tuple(2 * k for k in range(8) if b >> k & 1) for b in range(256))
+_SHIFTS = tuple(bytes([0, 1 << k]) + bytes(254) for k in range(8))
+_file: PrimeFile | None = None
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
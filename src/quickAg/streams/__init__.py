@@ -1,6 +1,8 @@
+from ._async import AsyncStream
 from ._elm import elm, even, ln, log, log1p, log2, log10, odd
 from ._streams import Stream, stream, null
 
+del _async
 del _elm
 del _streams
 
@@ -8,6 +10,7 @@ __all__ = [
     "elm",
     "stream",
     "Stream",
+    "AsyncStream",
     "even",
     "odd",
     "ln",
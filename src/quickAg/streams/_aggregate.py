@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+from heapq import nlargest, nsmallest
+from math import nan, sqrt
+from typing import Any, Callable, Iterable
+
+from ..structs.sketches import KLLSketch
+from ._batch import aslist
+from ._numpy import intsum
+
+# Every accumulator takes the elements one at a time with add, or a whole chunk
+# with extend, which is a list or, on the numpy backend, an array.
+
+
+class _Count:
+    __slots__ = ("n",)
+
+    def __init__(self) -> None:
+        self.n = 0
+
+    def add(self, val: Any) -> None:
+        self.n += 1
+
+    def extend(self, chunk: Any) -> None:
+        self.n += len(chunk)
+
+    def result(self) -> int:
+        return self.n
+
+
+class _Sum:
+    __slots__ = ("total",)
+
+    def __init__(self) -> None:
+        self.total: Any = 0
+
+    def add(self, val: Any) -> None:
+        self.total += val
+
+    def extend(self, chunk: Any) -> None:
+        self.total += intsum(chunk) if chunk.__class__ is not list else sum(chunk)
+
+    def result(self) -> Any:
+        return self.total
+
+
+class _Extreme:
+    # The first of the smallest (or largest) elements, as the builtins min and max.
+    __slots__ = ("key", "largest", "best", "bestkey", "empty")
+
+    def __init__(self, largest: bool, key: Callable[[Any], Any] | None = None) -> None:
+        self.key = key
+        self.largest = largest
+        self.best: Any = None
+        self.bestkey: Any = None
+        self.empty = True
+
+    def add(self, val: Any) -> None:
+        k = val if self.key is None else self.key(val)
+        if self.empty or (k > self.bestkey if self.largest else k < self.bestkey):
+            self.best, self.bestkey, self.empty = val, k, False
+
+    def extend(self, chunk: Any) -> None:
+        if self.key is None and chunk.__class__ is not list:
+            if len(chunk):
+                self.add((chunk.max() if self.largest else chunk.min()).item())
+            return
+        for v in chunk:
+            self.add(v)
+
+    def result(self) -> Any:
+        return self.best
+
+
+class _Moments:
+    # Welford's running mean and sum of squared deviations, with the partial
+    # results of whole arrays combined as in Chan et al.
+    __slots__ = ("n", "mean", "m2")
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, val: Any) -> None:
+        self.n += 1
+        d = val - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (val - self.mean)
+
+    def extend(self, chunk: Any) -> None:
+        if chunk.__class__ is list:
+            for v in chunk:
+                self.add(v)
+            return
+        nb = len(chunk)
+        if not nb:
+            return
+        mb = chunk.mean().item()
+        m2b = ((chunk - mb) ** 2).sum().item()
+        n = self.n + nb
+        d = mb - self.mean
+        self.mean += d * nb / n
+        self.m2 += m2b + d * d * self.n * nb / n
+        self.n = n
+
+    def var(self, ddof: int) -> float:
+        return self.m2 / (self.n - ddof) if self.n > ddof else nan
+
+
+class _Mean(_Moments):
+    __slots__ = ()
+
+    def result(self) -> float:
+        return self.mean if self.n else nan
+
+
+class _Var(_Moments):
+    __slots__ = ("ddof",)
+
+    def __init__(self, ddof: int = 1) -> None:
+        super().__init__()
+        self.ddof = ddof
+
+    def result(self) -> float:
+        return self.var(self.ddof)
+
+
+class _StdDev(_Var):
+    __slots__ = ()
+
+    def result(self) -> float:
+        return sqrt(self.var(self.ddof))
+
+
+class _Quantiles:
+    __slots__ = ("qs", "sketch")
+
+    def __init__(self, qs: Iterable[float], k: int = 200) -> None:
+        self.qs = list(qs)
+        if any(not 0 <= q <= 1 for q in self.qs):
+            raise ValueError("The quantiles must be between 0 and 1")
+        self.sketch = KLLSketch(k)
+
+    def add(self, val: Any) -> None:
+        self.sketch.add(val)
+
+    def extend(self, chunk: Any) -> None:
+        self.sketch.update(aslist(chunk))
+
+    def result(self) -> list[Any]:
+        if not len(self.sketch):
+            return [None] * len(self.qs)
+        return self.sketch.quantiles(self.qs)
+
+
+class _Top:
+    # The candidates are pruned back to the k best whenever they reach twice as
+    # many, so that the memory stays O(k). nlargest and nsmallest are stable, as
+    # sorted, so the equal elements keep the order they came in.
+    __slots__ = ("k", "key", "largest", "pick", "buf", "cap")
+
+    def __init__(self, k: int, key: Callable[[Any], Any] | None = None, largest: bool = True) -> None:
+        if k < 0:
+            raise ValueError("k must not be negative")
+        self.k = k
+        self.key = key
+        self.largest = largest
+        self.pick = nlargest if largest else nsmallest
+        self.buf: list[Any] = []
+        self.cap = max(2 * k, 64)
+
+    def add(self, val: Any) -> None:
+        self.buf.append(val)
+        if len(self.buf) >= self.cap:
+            self.buf = self.pick(self.k, self.buf, key=self.key)
+
+    def extend(self, chunk: Any) -> None:
+        if self.key is None and chunk.__class__ is not list and len(chunk) > self.k:
+            # Equal numbers cannot be told apart, so an unstable partition will do.
+            idx = chunk.argpartition(-self.k if self.largest else self.k - 1)
+            chunk = chunk[idx[-self.k :] if self.largest else idx[: self.k]] if self.k else chunk[:0]
+        self.buf.extend(aslist(chunk))
+        if len(self.buf) >= self.cap:
+            self.buf = self.pick(self.k, self.buf, key=self.key)
+
+    def result(self) -> list[Any]:
+        return self.pick(self.k, self.buf, key=self.key)
+
+
+_ACCUMULATORS: dict[str, Callable[..., Any]] = {
+    "count": _Count,
+    "sum": _Sum,
+    "min": lambda key=None: _Extreme(False, key),
+    "max": lambda key=None: _Extreme(True, key),
+    "mean": _Mean,
+    "var": _Var,
+    "stddev": _StdDev,
+    "quantiles": _Quantiles,
+    "topk": lambda k, key=None: _Top(k, key, True),
+    "bottomk": lambda k, key=None: _Top(k, key, False),
+}
+
+
+def accumulator(spec: str | tuple[Any, ...]) -> Any:
+    """Builds the accumulator of an aggregate spec: its name, or a tuple of the
+    name and the arguments, such as ("quantiles", [0.5, 0.9])."""
+    name, *args = (spec,) if isinstance(spec, str) else spec
+    if name not in _ACCUMULATORS:
+        raise ValueError(f"Unknown aggregate {name!r}, expected one of {', '.join(_ACCUMULATORS)}")
+    return _ACCUMULATORS[name](*args)
+
+
+def aggregate(accs: Iterable[Any], values: Iterable[Any], chunks: Iterable[Any] | None) -> None:
+    """Feeds every value to all the accumulators, in a single pass."""
+    accs = list(accs)
+    if chunks is not None:
+        for chunk in chunks:
+            for acc in accs:
+                acc.extend(chunk)
+        return
+    if len(accs) == 1:
+        add = accs[0].add
+        for v in values:
+            add(v)
+        return
+    adds = [acc.add for acc in accs]
+    for v in values:
+        for add in adds:
+            add(v)
@@ -0,0 +1,444 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from inspect import isawaitable
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Generic,
+    Iterable,
+    Literal,
+    TypeVar,
+)
+
+from ._result import StreamResult, _SFlow
+
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+_D = TypeVar("_D")
+
+_Stage = Callable[[StreamResult], Awaitable[StreamResult]]
+
+
+async def _call(func: Callable[[Any], Any], val: Any) -> Any:
+    # Every callable may be either a plain function or a coroutine function.
+    r = func(val)
+    if isawaitable(r):
+        r = await r
+    return r
+
+
+async def _fromasync(src: AsyncIterable[Any]) -> AsyncIterator[StreamResult]:
+    async for v in src:
+        yield StreamResult(v)
+
+
+async def _fromsync(src: Iterable[Any]) -> AsyncIterator[StreamResult]:
+    for v in src:
+        yield StreamResult(v)
+
+
+async def _fromstream(src: Any) -> AsyncIterator[StreamResult]:
+    for e in src._iter_raw_():
+        yield e
+
+
+async def _amapped(
+    src: AsyncIterator[StreamResult],
+    func: Callable[[Any], Any],
+    concurrency: int,
+    ordered: bool,
+) -> AsyncGenerator[StreamResult, None]:
+    # Keeps at most concurrency calls running as tasks. Elements that already carry
+    # an exception are passed along as they are, in their position: while they wait
+    # behind a task they count toward concurrency, so that the source is never read
+    # further ahead.
+    pending: deque[tuple[Any, asyncio.Task | None]] = deque()
+    done = False
+    try:
+        while True:
+            while not done and len(pending) < concurrency:
+                try:
+                    e = await src.__anext__()
+                except StopAsyncIteration:
+                    done = True
+                    break
+                if e.flw is not _SFlow.NORM or e.exc is not None:
+                    if ordered and pending:
+                        pending.append((e, None))
+                    else:
+                        yield e
+                    continue
+                pending.append((e.val, asyncio.ensure_future(_call(func, e.val))))
+            if not pending:
+                return
+            if ordered:
+                val, task = pending.popleft()
+            else:
+                i = next((i for i, (_, t) in enumerate(pending) if t is None or t.done()), None)
+                if i is None:
+                    await asyncio.wait([t for _, t in pending], return_when=asyncio.FIRST_COMPLETED)
+                    i = next(i for i, (_, t) in enumerate(pending) if t.done())  # type: ignore
+                val, task = pending[i]
+                del pending[i]
+            if task is None:
+                yield val
+                continue
+            try:
+                res = await task
+            except Exception as exc:
+                yield StreamResult(val, exc, _SFlow.EXCP)
+            else:
+                yield StreamResult(res)
+    finally:
+        for _, t in pending:
+            if t is not None:
+                t.cancel()
+        if hasattr(src, "aclose"):
+            await src.aclose()
+
+
+class AsyncStream(AsyncIterator[_T], Generic[_T]):
+    def __init__(self, __iter: AsyncIterable[_T] | Iterable[_T], *, forceraw: bool = False):
+        if forceraw:
+            self.__iter = __iter.__aiter__()  # type: ignore
+        elif isinstance(__iter, AsyncStream):
+            self.__iter = __iter._aiter_raw_()
+        elif hasattr(__iter, "_iter_raw_"):
+            self.__iter = _fromstream(__iter)
+        elif hasattr(__iter, "__aiter__"):
+            self.__iter = _fromasync(__iter)  # type: ignore
+        else:
+            self.__iter = _fromsync(__iter)  # type: ignore
+        self.__iter: AsyncIterator[StreamResult[_T]]
+
+        self.__stack: list[_Stage] = []
+        self.__status: _SFlow = _SFlow.NORM
+
+    def __aiter__(self) -> AsyncIterator[_T]:
+        return self
+
+    async def __anext__(self) -> _T:
+        e = await self._anext_raw_()
+
+        if e.flw != _SFlow.NORM:
+            raise RuntimeError(e)
+        return e.val
+
+    async def _anext_raw_(self) -> StreamResult:
+        while True:
+            if self.__status == _SFlow.STOP:
+                raise StopAsyncIteration
+
+            try:
+                e = await self.__iter.__anext__()
+            except StopAsyncIteration:
+                e = StreamResult(None, None, _SFlow.STOP)
+
+            for ev in self.__stack:
+                e = await ev(e)
+
+            match e.flw:
+                case _SFlow.SKIP:
+                    continue
+                case _SFlow.NORM:
+                    return e
+                case _SFlow.STOP:
+                    await self.__stop()
+                    raise StopAsyncIteration
+                case _SFlow.STAF:
+                    await self.__stop()
+                    return StreamResult(e.val, e.exc, _SFlow.NORM)
+                case _SFlow.EXCP:
+                    return e
+
+    async def _aiter_raw_(self) -> AsyncIterator[StreamResult[_T]]:
+        try:
+            while True:
+                yield await self._anext_raw_()
+        except StopAsyncIteration:
+            return
+
+    async def __stop(self) -> None:
+        self.__status = _SFlow.STOP
+        # Closes the pending work of an amap stage, or the source generator.
+        if hasattr(self.__iter, "aclose"):
+            await self.__iter.aclose()  # type: ignore
+
+    def filter(self, key: Callable[[_T], Any]) -> AsyncStream[_T]:
+        async def w(e: StreamResult[_T]) -> StreamResult[_T]:
+            match e:
+                case StreamResult(val, None, _SFlow.NORM):
+                    try:
+                        if not await _call(key, val):
+                            return StreamResult(val, None, _SFlow.SKIP)
+                        return StreamResult(val)
+                    except Exception as exc:
+                        return StreamResult(val, exc, _SFlow.EXCP)
+                case _:
+                    return e
+
+        self.__stack.append(w)
+        return self
+
+    def filterout(self, key: Callable[[_T], Any]) -> AsyncStream[_T]:
+        async def w(e: StreamResult[_T]) -> StreamResult[_T]:
+            match e:
+                case StreamResult(val, None, _SFlow.NORM):
+                    try:
+                        if await _call(key, val):
+                            return StreamResult(val, None, _SFlow.SKIP)
+                        return StreamResult(val)
+                    except Exception as exc:
+                        return StreamResult(val, exc, _SFlow.EXCP)
+                case _:
+                    return e
+
+        self.__stack.append(w)
+        return self
+
+    def stop(self, key: Callable[[_T], Any]) -> AsyncStream[_T]:
+        async def w(e: StreamResult[_T]) -> StreamResult[_T]:
+            match e:
+                case StreamResult(val, None, _SFlow.NORM):
+                    try:
+                        if not await _call(key, val):
+                            return StreamResult(val)
+                        return StreamResult(val, None, _SFlow.STOP)
+                    except Exception as exc:
+                        return StreamResult(val, exc, _SFlow.EXCP)
+                case _:
+                    return e
+
+        self.__stack.append(w)
+        return self
+
+    def stopafter(self, key: Callable[[_T], Any]) -> AsyncStream[_T]:
+        async def w(e: StreamResult[_T]) -> StreamResult[_T]:
+            match e:
+                case StreamResult(val, None, _SFlow.NORM):
+                    try:
+                        if not await _call(key, val):
+                            return StreamResult(val)
+                        return StreamResult(val, None, _SFlow.STAF)
+                    except Exception as exc:
+                        return StreamResult(val, exc, _SFlow.EXCP)
+                case _:
+                    return e
+
+        self.__stack.append(w)
+        return self
+
+    def limit(self, num: int) -> AsyncStream[_T]:
+        left = [num]
+
+        async def w(e: StreamResult[_T]) -> StreamResult[_T]:
+            match e:
+                case StreamResult(val, None, _SFlow.NORM):
+                    if left[0] <= 0:
+                        return StreamResult(val, None, _SFlow.STOP)
+                    left[0] -= 1
+                    return e
+                case _:
+                    return e
+
+        self.__stack.append(w)
+        return self
+
+    take = limit
+
+    def skip(self, num: int) -> AsyncStream[_T]:
+        left = [num]
+
+        async def w(e: StreamResult[_T]) -> StreamResult[_T]:
+            match e:
+                case StreamResult(val, None, _SFlow.NORM):
+                    if left[0] > 0:
+                        left[0] -= 1
+                        return StreamResult(val, None, _SFlow.SKIP)
+                    return e
+                case _:
+                    return e
+
+        self.__stack.append(w)
+        return self
+
+    def eval(self, func: Callable[[_T], _R] | Callable[[_T], Awaitable[_R]]) -> AsyncStream[_R]:
+        async def w(e: StreamResult[_T]) -> StreamResult[_R | None]:
+            match e:
+                case StreamResult(val, None, _SFlow.NORM):
+                    try:
+                        return StreamResult(await _call(func, val))
+                    except Exception as exc:
+                        return StreamResult(val, exc, _SFlow.EXCP)  # type: ignore
+                case _:
+                    return e  # type: ignore
+
+        self.__stack.append(w)
+        return self  # type: ignore
+
+    map = eval
+
+    def act(self, func: Callable[[_T], Any]) -> AsyncStream[_T]:
+        async def w(e: StreamResult[_T]) -> StreamResult[_T]:
+            match e:
+                case StreamResult(val, None, _SFlow.NORM):
+                    try:
+                        await _call(func, val)
+                        return StreamResult(val)
+                    except Exception as exc:
+                        return StreamResult(val, exc, _SFlow.EXCP)
+                case _:
+                    return e
+
+        self.__stack.append(w)
+        return self
+
+    def amap(
+        self,
+        func: Callable[[_T], Awaitable[_R]] | Callable[[_T], _R],
+        concurrency: int = 8,
+        ordered: bool = True,
+    ) -> AsyncStream[_R]:
+        if concurrency < 1:
+            raise ValueError("The concurrency must be at least 1")
+        # The stages so far move to an inner stream, which feeds the tasks.
+        inner = object.__new__(AsyncStream)
+        inner.__dict__.update(self.__dict__)
+        AsyncStream.__init__(self, _amapped(inner._aiter_raw_(), func, concurrency, ordered), forceraw=True)
+        return self  # type: ignore
+
+    def exc(self, exct: type[Exception], todo: Literal["skip", "stop"] = "skip") -> AsyncStream[_T]:
+        async def w(e: StreamResult[_T]) -> StreamResult[_T]:
+            match e:
+                case StreamResult(val, exct(), _SFlow.EXCP):
+                    match todo:
+                        case "skip":
+                            return StreamResult(val, None, _SFlow.SKIP)
+                        case "stop":
+                            return StreamResult(val, None, _SFlow.STOP)
+                        case _:
+                            return e
+                case _:
+                    return e
+
+        self.__stack.append(w)
+        return self
+
+    def excg(self, exct: type[Exception], todo: Literal["skip", "stop"] = "skip") -> AsyncStream[_T]:
+        async def w(e: StreamResult[_T]) -> StreamResult[_T]:
+            do = False
+            match e:
+                case StreamResult(val, ExceptionGroup() as excg, _SFlow.EXCP):
+                    if any(isinstance(ex, exct) for ex in excg.exceptions):
+                        do = True
+                case StreamResult(val, exct(), _SFlow.EXCP):
+                    do = True
+                case _:
+                    return e
+
+            if do:
+                match todo:
+                    case "skip":
+                        return StreamResult(val, None, _SFlow.SKIP)
+                    case "stop":
+                        return StreamResult(val, None, _SFlow.STOP)
+                    case _:
+                        return e
+            return e
+
+        self.__stack.append(w)
+        return self
+
+    @property
+    def unique(self) -> AsyncStream[_T]:
+        seen = set()
+
+        async def w(e: StreamResult[_T]) -> StreamResult[_T]:
+            match e:
+                case StreamResult(val, None, _SFlow.NORM):
+                    if val in seen:
+                        return StreamResult(val, None, _SFlow.SKIP)
+                    seen.add(val)
+                    return e
+                case _:
+                    return e
+
+        self.__stack.append(w)
+        return self
+
+    async def reduce(self, func: Callable[[_T, _T], Any], defaultvalue: _D = None) -> _T | _D:
+        try:
+            res = await self.__anext__()
+        except StopAsyncIteration:
+            return defaultvalue
+        async for val in self:
+            res = func(res, val)
+            if isawaitable(res):
+                res = await res
+        return res
+
+    async def __collect(self) -> list[_T]:
+        return [v async for v in self]
+
+    @property
+    def list(self) -> Coroutine[Any, Any, list[_T]]:
+        return self.__collect()
+
+    @property
+    def tuple(self) -> Coroutine[Any, Any, tuple[_T, ...]]:
+        async def f() -> tuple[_T, ...]:
+            return tuple(await self.__collect())
+
+        return f()
+
+    @property
+    def set(self) -> Coroutine[Any, Any, set[_T]]:
+        async def f() -> set[_T]:
+            return {v async for v in self}
+
+        return f()
+
+    @property
+    def null(self) -> Coroutine[Any, Any, None]:
+        async def f() -> None:
+            async for _ in self:
+                pass
+
+        return f()
+
+    @property
+    def count(self) -> Coroutine[Any, Any, int]:
+        async def f() -> int:
+            n = 0
+            async for _ in self:
+                n += 1
+            return n
+
+        return f()
+
+    @property
+    def any(self) -> Coroutine[Any, Any, bool]:
+        async def f() -> bool:
+            async for v in self:
+                if v:
+                    return True
+            return False
+
+        return f()
+
+    @property
+    def all(self) -> Coroutine[Any, Any, bool]:
+        async def f() -> bool:
+            async for v in self:
+                if not v:
+                    return False
+            return True
+
+        return f()
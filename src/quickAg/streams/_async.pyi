@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Generic,
+    Iterable,
+    Literal,
+    TypeVar,
+)
+
+from ._result import StreamResult
+
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+_D = TypeVar("_D")
+
+class AsyncStream(AsyncIterator[_T], Generic[_T]):
+    """
+    Asynchronous counterpart of Stream, built on an async or regular iterable.
+    The stages accept both plain and coroutine functions, and route exceptions in
+    the same way as Stream, so exc and excg behave identically. The terminal
+    operations are awaitable:
+    await stream.aiter(source).eval(fetch).exc(OSError).list
+    """
+    def __init__(self, __iter: AsyncIterable[_T] | Iterable[_T], *, forceraw: bool = False): ...
+    def __aiter__(self) -> AsyncIterator[_T]: ...
+    async def __anext__(self) -> _T: ...
+    def filter(self, key: Callable[[_T], Any]) -> AsyncStream[_T]:
+        """
+        Keeps the elements for which key returns a truthy value.
+        """
+    def filterout(self, key: Callable[[_T], Any]) -> AsyncStream[_T]:
+        """
+        Discards the elements for which key returns a truthy value.
+        """
+    def stop(self, key: Callable[[_T], Any]) -> AsyncStream[_T]:
+        """
+        Stops the stream at the first element for which key is truthy.
+        """
+    def stopafter(self, key: Callable[[_T], Any]) -> AsyncStream[_T]:
+        """
+        Stops the stream after the first element for which key is truthy.
+        """
+    def limit(self, num: int) -> AsyncStream[_T]:
+        """
+        Stops the stream after num elements.
+        """
+    def take(self, num: int) -> AsyncStream[_T]:
+        """
+        Alias of limit.
+        """
+    def skip(self, num: int) -> AsyncStream[_T]:
+        """
+        Discards the first num elements.
+        """
+    def eval(self, func: Callable[[_T], _R] | Callable[[_T], Awaitable[_R]]) -> AsyncStream[_R]:
+        """
+        Replaces every element with the result of func, awaited one at a time.
+        """
+    def map(self, func: Callable[[_T], _R] | Callable[[_T], Awaitable[_R]]) -> AsyncStream[_R]:
+        """
+        Alias of eval.
+        """
+    def act(self, func: Callable[[_T], Any]) -> AsyncStream[_T]:
+        """
+        Calls func on every element, keeping the element.
+        """
+    def amap(
+        self,
+        func: Callable[[_T], Awaitable[_R]] | Callable[[_T], _R],
+        concurrency: int = 8,
+        ordered: bool = True,
+    ) -> AsyncStream[_R]:
+        """
+        Replaces every element with the result of func, running up to
+        concurrency calls at the same time. With ordered=False the results are
+        returned in completion order.
+        """
+    def exc(self, exct: type[Exception], todo: Literal["skip", "stop"] = "skip") -> AsyncStream[_T]:
+        """
+        Skips the elements that raised an exception of type exct, or stops the
+        stream on them.
+        """
+    def excg(self, exct: type[Exception], todo: Literal["skip", "stop"] = "skip") -> AsyncStream[_T]:
+        """
+        Like exc, but also matches exception groups containing exct.
+        """
+    @property
+    def unique(self) -> AsyncStream[_T]:
+        """
+        Returns every element only once.
+        """
+    async def reduce(self, func: Callable[[_T, _T], Any], defaultvalue: _D = None) -> _T | _D:
+        """
+        Applies the reduction function to the elements of the stream. The
+        function may be a coroutine function.
+        """
+    @property
+    def list(self) -> Coroutine[Any, Any, list[_T]]: ...
+    @property
+    def tuple(self) -> Coroutine[Any, Any, tuple[_T, ...]]: ...
+    @property
+    def set(self) -> Coroutine[Any, Any, set[_T]]: ...
+    @property
+    def null(self) -> Coroutine[Any, Any, None]: ...
+    @property
+    def count(self) -> Coroutine[Any, Any, int]: ...
+    @property
+    def any(self) -> Coroutine[Any, Any, bool]: ...
+    @property
+    def all(self) -> Coroutine[Any, Any, bool]: ...
+    # UNDOCUMENTED METHODS (THEY ARE ONLY TO BE USED INTERNALLY):
+    async def _anext_raw_(self) -> StreamResult[_T]: ...
+    def _aiter_raw_(self) -> AsyncIterator[StreamResult[_T]]: ...
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+from itertools import compress, count
+from typing import Any, Callable, Sequence
+
+from ..math.primes import is_prime, is_prime_many
+from ._compile import _Fault
+from ._elm import compiled
+from ._result import StreamResult, _SFlow
+
+# A chunk is a list of values, where the elements that raised an exception are
+# kept in place as _Fault objects. A chunk is clean when it holds no _Fault, and
+# only clean chunks go through the fast paths below: every other chunk is handed
+# element by element to the original stage, which is exact by construction.
+# Every stage takes (chunk, clean) and returns (chunk, clean, end). When the stream
+# stops inside the chunk, end holds the elements that leave the stream after the
+# returned chunk without going through the following stages (the element that
+# triggered a stopafter), otherwise end is None.
+_End = list[Any] | None
+_Stage = Callable[[list[Any], bool], tuple[list[Any], bool, _End]]
+
+# Functions with a version working on a whole chunk at once, which must return the
+# same results as mapping the function over the chunk whenever it does not raise.
+_VECTORIZED: tuple[tuple[Callable[[Any], Any], Callable[[Any], Any]], ...] = ((is_prime, is_prime_many),)
+
+
+def vectorized(func: Callable[[Any], Any]) -> Callable[[Any], Any] | None:
+    # Compared by identity, as elm expressions cannot be hashed.
+    for f, many in _VECTORIZED:
+        if func is f:
+            return many
+    return None
+
+
+def aslist(chunk: Any) -> list[Any]:
+    return chunk if chunk.__class__ is list else chunk.tolist()
+
+
+def _mapped(func: Callable[[Any], Any], chunk: list[Any]) -> tuple[list[Any], bool]:
+    # list.extend keeps the items appended before an exception, so the index of
+    # the failing element is the length of the output at that time.
+    func = compiled(func)
+    out: list[Any] = []
+    it = iter(chunk)
+    clean = True
+    while True:
+        try:
+            out.extend(map(func, it))
+            return out, clean
+        except Exception as exc:
+            out.append(_Fault(StreamResult(chunk[len(out)], exc, _SFlow.EXCP)))
+            clean = False
+
+
+def _each(w: Callable[[StreamResult], StreamResult], chunk: list[Any]) -> tuple[list[Any], bool, _End]:
+    out: list[Any] = []
+    clean = True
+    for v in chunk:
+        e = w(v.res if v.__class__ is _Fault else StreamResult(v))
+        match e.flw:
+            case _SFlow.NORM:
+                out.append(e.val)
+            case _SFlow.SKIP:
+                pass
+            case _SFlow.STOP:
+                return out, clean, []
+            case _SFlow.STAF:
+                return out, clean, [e.val]
+            case _SFlow.EXCP:
+                out.append(_Fault(e))
+                clean = False
+    return out, clean, None
+
+
+def _masked(mask: list[Any], chunk: list[Any], keep: bool) -> tuple[list[Any], bool]:
+    # Truth testing happens here rather than inside the key, so it gets the same
+    # exception routing as the key itself.
+    out: list[Any] = []
+    clean = True
+    for v, m in zip(chunk, mask):
+        if m.__class__ is _Fault:
+            out.append(m)
+            clean = False
+            continue
+        try:
+            if bool(m) is keep:
+                out.append(v)
+        except Exception as exc:
+            out.append(_Fault(StreamResult(v, exc, _SFlow.EXCP)))
+            clean = False
+    return out, clean
+
+
+def _cutoff(mask: list[Any], chunk: list[Any], after: bool) -> tuple[list[Any], bool, _End]:
+    out: list[Any] = []
+    clean = True
+    for v, m in zip(chunk, mask):
+        if m.__class__ is _Fault:
+            out.append(m)
+            clean = False
+            continue
+        try:
+            if m:
+                return out, clean, [v] if after else []
+        except Exception as exc:
+            out.append(_Fault(StreamResult(v, exc, _SFlow.EXCP)))
+            clean = False
+            continue
+        out.append(v)
+    return out, clean, None
+
+
+def _filter(w: Callable, key: Callable[[Any], Any], keep: bool) -> _Stage:
+    many = vectorized(key)
+
+    def stage(chunk: list[Any], clean: bool) -> tuple[list[Any], bool, _End]:
+        if not clean:
+            return _each(w, chunk)
+        if many is not None:
+            try:
+                mask = many(chunk)
+            except Exception:
+                pass
+            else:
+                if keep:
+                    return list(compress(chunk, mask)), True, None
+                return [v for v, m in zip(chunk, mask) if not m], True, None
+        mask, mclean = _mapped(key, chunk)
+        if mclean:
+            try:
+                if keep:
+                    return list(compress(chunk, mask)), True, None
+                return [v for v, m in zip(chunk, mask) if not m], True, None
+            except Exception:
+                pass
+        return (*_masked(mask, chunk, keep), None)
+
+    return stage
+
+
+def _stop(w: Callable, key: Callable[[Any], Any], after: bool) -> _Stage:
+    def stage(chunk: list[Any], clean: bool) -> tuple[list[Any], bool, _End]:
+        if not clean:
+            return _each(w, chunk)
+        mask, mclean = _mapped(key, chunk)
+        if mclean:
+            try:
+                k = next(compress(count(), mask), None)
+            except Exception:
+                return _cutoff(mask, chunk, after)
+            if k is None:
+                return chunk, True, None
+            return chunk[:k], True, [chunk[k]] if after else []
+        return _cutoff(mask, chunk, after)
+
+    return stage
+
+
+def _eval(w: Callable, func: Callable[[Any], Any]) -> _Stage:
+    def stage(chunk: list[Any], clean: bool) -> tuple[list[Any], bool, _End]:
+        if not clean:
+            return _each(w, chunk)
+        return (*_mapped(func, chunk), None)
+
+    return stage
+
+
+def _act(w: Callable, func: Callable[[Any], Any]) -> _Stage:
+    def stage(chunk: list[Any], clean: bool) -> tuple[list[Any], bool, _End]:
+        if not clean:
+            return _each(w, chunk)
+        res, rclean = _mapped(func, chunk)
+        if rclean:
+            return chunk, True, None
+        return [r if r.__class__ is _Fault else v for v, r in zip(chunk, res)], False, None
+
+    return stage
+
+
+def _limit(w: Any) -> _Stage:
+    def stage(chunk: list[Any], clean: bool) -> tuple[list[Any], bool, _End]:
+        if not clean:
+            return _each(w, chunk)
+        left = w.limit - w.count
+        if len(chunk) > left:
+            w.count += max(left, 0)
+            return chunk[: max(left, 0)], True, []
+        w.count += len(chunk)
+        return chunk, True, None
+
+    return stage
+
+
+def _skip(w: Any) -> _Stage:
+    def stage(chunk: list[Any], clean: bool) -> tuple[list[Any], bool, _End]:
+        if not clean:
+            return _each(w, chunk)
+        left = w.skip - w.count
+        w.count += len(chunk)
+        if left > 0:
+            return chunk[left:], True, None
+        return chunk, True, None
+
+    return stage
+
+
+def _unique(w: Any) -> _Stage:
+    def stage(chunk: list[Any], clean: bool) -> tuple[list[Any], bool, _End]:
+        if not clean:
+            return _each(w, chunk)
+        seen = w.cache
+        return [v for v in chunk if not (v in seen or seen.add(v))], True, None
+
+    return stage
+
+
+def _handler(w: Callable) -> _Stage:
+    def stage(chunk: list[Any], clean: bool) -> tuple[list[Any], bool, _End]:
+        if not clean:
+            return _each(w, chunk)
+        return chunk, True, None
+
+    return stage
+
+
+def _opaque(w: Callable) -> _Stage:
+    def stage(chunk: list[Any], clean: bool) -> tuple[list[Any], bool, _End]:
+        return _each(w, chunk)
+
+    return stage
+
+
+def chunked(stack: Sequence[Callable], spec: Sequence[tuple[Any, ...]]) -> list[_Stage]:
+    """Returns the chunk version of every stage of the stack."""
+    out: list[_Stage] = []
+    for w, s in zip(stack, spec):
+        match s:
+            case ("filter", key):
+                out.append(_filter(w, key, True))
+            case ("filterout", key):
+                out.append(_filter(w, key, False))
+            case ("stop", key):
+                out.append(_stop(w, key, False))
+            case ("stopafter", key):
+                out.append(_stop(w, key, True))
+            case ("eval", func):
+                out.append(_eval(w, func))
+            case ("act", func):
+                out.append(_act(w, func))
+            case ("limit", _):
+                out.append(_limit(w))
+            case ("skip", _):
+                out.append(_skip(w))
+            case ("unique",):
+                out.append(_unique(w))
+            case ("exc" | "excg", *_):
+                out.append(_handler(w))
+            case _:
+                out.append(_opaque(w))
+    return out
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from types import CodeType
+from typing import Any, Callable, Iterator, Sequence
+
+from ._elm import compiled
+from ._result import StreamResult, _SFlow
+
+# Stages that the compiler knows how to inline. Each template operates on the
+# current value `v` and returns early as soon as the element leaves the NORM flow,
+# as every following known stage would pass it along unchanged. Exceptions are
+# routed only through the exc/excg handlers placed after the failing stage, which
+# are the only known stages that act on EXCP results.
+_TEMPLATES: dict[str, tuple[str, ...]] = {
+    "filter": (
+        "try:",
+        "    if not _a{j}(v):",
+        "        return _SR(v, None, _SKIP)",
+        "except Exception as x:",
+        "    return {excp}",
+    ),
+    "filterout": (
+        "try:",
+        "    if _a{j}(v):",
+        "        return _SR(v, None, _SKIP)",
+        "except Exception as x:",
+        "    return {excp}",
+    ),
+    "stop": (
+        "try:",
+        "    if _a{j}(v):",
+        "        return _SR(v, None, _STOP)",
+        "except Exception as x:",
+        "    return {excp}",
+    ),
+    "stopafter": (
+        "try:",
+        "    if _a{j}(v):",
+        "        return _SR(v, None, _STAF)",
+        "except Exception as x:",
+        "    return {excp}",
+    ),
+    "limit": (
+        "if _w{j}.count >= _w{j}.limit:",
+        "    return _SR(v, None, _STOP)",
+        "_w{j}.count += 1",
+    ),
+    "skip": (
+        "_w{j}.count += 1",
+        "if _w{j}.count <= _w{j}.skip:",
+        "    return _SR(v, None, _SKIP)",
+    ),
+    "eval": (
+        "try:",
+        "    v = _a{j}(v)",
+        "except Exception as x:",
+        "    return {excp}",
+    ),
+    "act": (
+        "try:",
+        "    _a{j}(v)",
+        "except Exception as x:",
+        "    return {excp}",
+    ),
+    "unique": (
+        "if v in _c{j}:",
+        "    return _SR(v, None, _SKIP)",
+        "_c{j}.add(v)",
+    ),
+    "uniqueret": (
+        "try:",
+        "    r = _a{j}(v)",
+        "except Exception as x:",
+        "    return {excp}",
+        "if r in _c{j}:",
+        "    return _SR(v, None, _SKIP)",
+        "_c{j}.add(r)",
+    ),
+    "duplicates": (
+        "if v not in _c{j}:",
+        "    _c{j}[v] = 1",
+        "    return _SR(v, None, _SKIP)",
+        "if _c{j}[v] != 1:",
+        "    return _SR(v, None, _SKIP)",
+        "_c{j}[v] += 1",
+    ),
+    "exc": (),
+    "excg": (),
+}
+
+_HANDLERS = frozenset(("exc", "excg"))
+
+# Stages that cannot turn an exception into a flow change, so that a pipeline made
+# only of them can run directly on the values of the source. The flow is signalled
+# by plain control statements, and a StreamResult is only built for the elements
+# that raise, which are handed over to the `fault` callback.
+_PLAIN: dict[str, tuple[str, ...]] = {
+    "filter": (
+        "try:",
+        "    if not _a{j}(v):",
+        "        continue",
+        "except Exception as x:",
+        "    yield fault(_SR(v, x, _EXCP))",
+        "    continue",
+    ),
+    "filterout": (
+        "try:",
+        "    if _a{j}(v):",
+        "        continue",
+        "except Exception as x:",
+        "    yield fault(_SR(v, x, _EXCP))",
+        "    continue",
+    ),
+    "stop": (
+        "try:",
+        "    if _a{j}(v):",
+        "        return",
+        "except Exception as x:",
+        "    yield fault(_SR(v, x, _EXCP))",
+        "    continue",
+    ),
+    "stopafter": (
+        "try:",
+        "    t = _a{j}(v)",
+        "except Exception as x:",
+        "    yield fault(_SR(v, x, _EXCP))",
+        "    continue",
+        "if t:",
+        "    yield v",
+        "    return",
+    ),
+    "limit": (
+        "if _w{j}.count >= _w{j}.limit:",
+        "    return",
+        "_w{j}.count += 1",
+    ),
+    "skip": (
+        "_w{j}.count += 1",
+        "if _w{j}.count <= _w{j}.skip:",
+        "    continue",
+    ),
+    "eval": (
+        "try:",
+        "    v = _a{j}(v)",
+        "except Exception as x:",
+        "    yield fault(_SR(v, x, _EXCP))",
+        "    continue",
+    ),
+    "act": (
+        "try:",
+        "    _a{j}(v)",
+        "except Exception as x:",
+        "    yield fault(_SR(v, x, _EXCP))",
+        "    continue",
+    ),
+    "unique": (
+        "if v in _c{j}:",
+        "    continue",
+        "_c{j}.add(v)",
+    ),
+}
+
+
+class _Fault:
+    """Carries the StreamResult of an element that raised out of a plain pipeline,
+    so that it cannot be mistaken for a value of the stream."""
+
+    __slots__ = ("res",)
+
+    def __init__(self, res: StreamResult) -> None:
+        self.res = res
+
+
+def _route(e: StreamResult, handlers: Sequence[Callable[[StreamResult], StreamResult]]) -> StreamResult:
+    for h in handlers:
+        e = h(e)
+    return e
+
+
+@lru_cache(maxsize=256)
+def _codegen(ops: tuple[str, ...]) -> CodeType:
+    lines = [
+        "def _fused(e):",
+        "    if e.flw is not _NORM or e.exc is not None:",
+        "        return _route(e, _hall)" if _HANDLERS.intersection(ops) else "        return e",
+        "    v = e.val",
+    ]
+    for j, op in enumerate(ops):
+        if _HANDLERS.intersection(ops[j + 1 :]):
+            excp = f"_route(_SR(v, x, _EXCP), _h{j})"
+        else:
+            excp = "_SR(v, x, _EXCP)"
+        lines.extend("    " + ln.format(j=j, excp=excp) for ln in _TEMPLATES[op])
+    lines.append("    return _SR(v)")
+    return compile("\n".join(lines), f"<fused {'.'.join(ops)}>", "exec")
+
+
+@lru_cache(maxsize=256)
+def _plaingen(ops: tuple[str, ...]) -> CodeType:
+    lines = [
+        "def _plain(src, fault):",
+        "    for v in src:",
+    ]
+    for j, op in enumerate(ops):
+        lines.extend("        " + ln.format(j=j) for ln in _PLAIN[op])
+    lines.append("        yield v")
+    return compile("\n".join(lines), f"<plain {'.'.join(ops)}>", "exec")
+
+
+def _namespace(stages: Sequence[Callable], spec: Sequence[tuple[Any, ...]]) -> dict[str, Any]:
+    ops = tuple(s[0] for s in spec)
+    ns: dict[str, Any] = {
+        "_SR": StreamResult,
+        "_NORM": _SFlow.NORM,
+        "_SKIP": _SFlow.SKIP,
+        "_STOP": _SFlow.STOP,
+        "_STAF": _SFlow.STAF,
+        "_EXCP": _SFlow.EXCP,
+        "_route": _route,
+        "_hall": tuple(w for w, op in zip(stages, ops) if op in _HANDLERS),
+    }
+    for j, (w, s) in enumerate(zip(stages, spec)):
+        ns[f"_w{j}"] = w
+        if len(s) > 1:
+            ns[f"_a{j}"] = compiled(s[1])
+        if hasattr(w, "cache"):
+            ns[f"_c{j}"] = w.cache
+        ns[f"_h{j}"] = tuple(h for h, op in zip(stages[j + 1 :], ops[j + 1 :]) if op in _HANDLERS)
+    return ns
+
+
+def _fuse(stages: Sequence[Callable], spec: Sequence[tuple[Any, ...]]) -> Callable:
+    ns = _namespace(stages, spec)
+    exec(_codegen(tuple(s[0] for s in spec)), ns)
+    return ns["_fused"]
+
+
+def fuse(stack: Sequence[Callable], spec: Sequence[tuple[Any, ...]]) -> list[Callable]:
+    """Returns an equivalent stack where every run of consecutive known stages is
+    replaced by a single generated function. Unknown stages are kept as they are,
+    and act as boundaries between the fused runs."""
+    out: list[Callable] = []
+    run: list[int] = []
+    for i, s in enumerate(spec):
+        if s and s[0] in _TEMPLATES:
+            run.append(i)
+            continue
+        if run:
+            out.append(_fuse([stack[j] for j in run], [spec[j] for j in run]))
+            run = []
+        out.append(stack[i])
+    if run:
+        out.append(_fuse([stack[j] for j in run], [spec[j] for j in run]))
+    return out
+
+
+def plain(
+    stack: Sequence[Callable], spec: Sequence[tuple[Any, ...]]
+) -> Callable[[Iterator[Any], Callable[[StreamResult], Any]], Iterator[Any]] | None:
+    """Returns a generator function running the whole stack on the raw values of a
+    source, or None if any of the stages needs the StreamResult machinery."""
+    if not all(s and s[0] in _PLAIN for s in spec):
+        return None
+    ns = _namespace(stack, spec)
+    exec(_plaingen(tuple(s[0] for s in spec)), ns)
+    return ns["_plain"]
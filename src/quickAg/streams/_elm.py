@@ -2,217 +2,410 @@ from __future__ import annotations
 
 import math
 from collections.abc import Callable
+from enum import Enum, auto
+from functools import lru_cache
+from types import CodeType
 from typing import Any, overload
 
 
+def _identity(x: Any) -> Any:
+    return x
+
+
+# An expression is a tree of tuples, made of a node kind and its operands: _X is
+# the element itself, (CONST, v) a constant, (FN, f, *args) the call f(*args) and
+# (CALL, name, obj, *args) the method call obj.name(*args), where args are
+# expressions. The operators call the dunder methods directly, as in x.__add__(1),
+# so they keep their exact semantics (NotImplemented included) in the generated
+# code. The tree holds no code of its own, so it pickles whenever its constants
+# and functions do.
+class _Op(Enum):
+    ELM = auto()
+    CONST = auto()
+    FN = auto()
+    CALL = auto()
+
+
+_X = (_Op.ELM,)
+# Constants written as literals in the generated source, rather than looked up:
+# their repr evaluates back to an equal object of the same type.
+_LITERALS = (int, str, bool, type(None))
+
+
+# Functions of the expressions without side effects, which always return a float.
+_PURE = (math.log, math.log2, math.log10, math.log1p)
+# Constants that can be operated on while optimizing, as their operations have no
+# side effects and return immutable objects.
+_FOLDABLE = (int, float, complex, str, bool, type(None))
+# Dunder methods of float returning a float for int or float operands, never
+# NotImplemented.
+_FLOAT_OPS = frozenset(
+    "__add__ __sub__ __mul__ __truediv__ __floordiv__ __mod__ __radd__ __rsub__ __rmul__ __rtruediv__ "
+    "__rfloordiv__ __rmod__ __neg__ __pos__ __abs__".split()
+)
+# Operations that return their float operand unchanged for the given constant.
+# Adding 0 is not one, as -0.0 + 0 is 0.0.
+_FLOAT_UNITS = {"__sub__": 0, "__mul__": 1, "__rmul__": 1, "__truediv__": 1, "__pow__": 1}
+
+
+def _numeric(node: tuple[Any, ...], t: type | None, args: list[type | None]) -> type | None:
+    # The type of the value of a call node, when its receiver is known to be a
+    # float, its operands int or float and the method exact on them. The receiver
+    # is an elm expression, and only the pure functions are known to return a
+    # number, so an int receiver is always a folded constant.
+    if t is float and all(a is int or a is float for a in args) and node[1] in _FLOAT_OPS:
+        return float
+    return None
+
+
+def _simplified(
+    node: tuple[Any, ...], t: type | None, types: list[type | None]
+) -> tuple[tuple[Any, ...], type | None]:
+    # Folds the constant operations and removes the numeric identities from a call
+    # node, whose operands are already simplified, with t the type of the receiver
+    # and types those of the arguments.
+    name, obj, args = node[1], node[2], node[3:]
+    if obj[0] is _Op.CONST and all(a[0] is _Op.CONST for a in args):
+        vals = (obj[1], *(a[1] for a in args))
+        if all(v.__class__ in _FOLDABLE for v in vals):
+            try:
+                v = getattr(vals[0], name)(*vals[1:])
+            except Exception:
+                return node, _numeric(node, t, types)
+            return (_Op.CONST, v), v.__class__ if v.__class__ in (int, float) else None
+    if t is float:
+        if name == "__pos__" and not args:
+            return obj, t
+        if name == "__neg__" and not args and obj[0] is _Op.CALL and obj[1] == name and not obj[3:]:
+            return obj[2], t
+        if len(args) == 1 and args[0][0] is _Op.CONST:
+            c = args[0][1]
+            if c.__class__ in (int, float) and _FLOAT_UNITS.get(name) == c:
+                return obj, t
+    return node, _numeric(node, t, types)
+
+
+def _optimized(
+    node: tuple[Any, ...], memo: dict[int, tuple[tuple[Any, ...], type | None]]
+) -> tuple[tuple[Any, ...], type | None]:
+    # Returns the simplified node with the type of its value, if known to be int or
+    # float. Shared subtrees are simplified once.
+    if node[0] is _Op.ELM:
+        return node, None
+    if node[0] is _Op.CONST:
+        return node, node[1].__class__ if node[1].__class__ in (int, float) else None
+    if id(node) in memo:
+        return memo[id(node)]
+    if node[0] is _Op.FN:
+        args = tuple(_optimized(a, memo)[0] for a in node[2:])
+        res: tuple[tuple[Any, ...], type | None] = ((_Op.FN, node[1], *args), None)
+        if any(node[1] is f for f in _PURE):
+            res = res[0], float
+            if all(a[0] is _Op.CONST and a[1].__class__ in (int, float) for a in args):
+                try:
+                    res = (_Op.CONST, node[1](*(a[1] for a in args))), float
+                except Exception:
+                    pass
+    else:
+        obj, t = _optimized(node[2], memo)
+        args, types = zip(*(_optimized(a, memo) for a in node[3:])) if node[3:] else ((), ())
+        res = _simplified((_Op.CALL, node[1], obj, *args), t, list(types))
+    memo[id(node)] = res
+    return res
+
+
+def _source(node: tuple[Any, ...], ns: dict[str, Any]) -> str:
+    # Equal subexpressions are interned to the same index, and those used more than
+    # once are evaluated at their first use into a temporary, with an assignment
+    # expression, and read back afterwards. Calls to functions other than the pure
+    # ones are never merged, as each may have side effects.
+    table: list[tuple[Any, ...]] = []
+    refs: list[int] = []
+    index: dict[tuple[Any, ...], int] = {}
+    seen: dict[int, int] = {}
+
+    def entry(item: tuple[Any, ...], key: tuple[Any, ...] | None) -> int:
+        if key is not None and key in index:
+            return index[key]
+        i = len(table)
+        table.append(item)
+        refs.append(0)
+        for c in item[2:]:
+            refs[c] += 1
+        if key is not None:
+            index[key] = i
+        return i
+
+    def intern(node: tuple[Any, ...]) -> int:
+        if id(node) in seen:
+            return seen[id(node)]
+        if node[0] is _Op.ELM:
+            i = entry((_Op.ELM, None), _X)
+        elif node[0] is _Op.CONST:
+            v = node[1]
+            # By repr, so that 0.0 and -0.0, or 1 and True, stay apart.
+            key = (_Op.CONST, v.__class__, repr(v)) if v.__class__ in _FOLDABLE else (_Op.CONST, id(v))
+            i = entry((_Op.CONST, v), key)
+        elif node[0] is _Op.CALL:
+            kids = (intern(node[2]), *map(intern, node[3:]))
+            i = entry((_Op.CALL, node[1], *kids), (_Op.CALL, node[1], *kids))
+        else:
+            kids = tuple(map(intern, node[2:]))
+            pure = any(node[1] is f for f in _PURE)
+            i = entry((_Op.FN, node[1], *kids), (_Op.FN, id(node[1]), *kids) if pure else None)
+        if node[0] is not _Op.FN or any(node[1] is f for f in _PURE):
+            seen[id(node)] = i
+        return i
+
+    temps: dict[int, str] = {}
+
+    def emit(i: int) -> str:
+        if i in temps:
+            return temps[i]
+        kind, head, *kids = table[i]
+        if kind is _Op.ELM:
+            return "x"
+        if kind is _Op.CONST:
+            if head.__class__ in _LITERALS:
+                return f"({head!r})"
+            temps[i] = f"_k{len(ns)}"
+            ns[temps[i]] = head
+            return temps[i]
+        if kind is _Op.CALL:
+            obj = emit(kids[0])
+            src = f"{obj}.{head}({', '.join(map(emit, kids[1:]))})"
+        else:
+            name = f"_k{len(ns)}"
+            ns[name] = head
+            src = f"{name}({', '.join(map(emit, kids))})"
+        if refs[i] < 2:
+            return src
+        temps[i] = f"_t{len(temps)}"
+        return f"({temps[i]} := {src})"
+
+    return emit(intern(node))
+
+
+@lru_cache(maxsize=256)
+def _codegen(src: str) -> CodeType:
+    return compile(f"lambda x: {src}", "<elm>", "eval")
+
+
+def _interpreted(node: tuple[Any, ...]) -> Callable[[Any], Any]:
+    # Nested closures, one per node, for the expressions too deep to be compiled.
+    if node[0] is _Op.ELM:
+        return _identity
+    if node[0] is _Op.CONST:
+        v = node[1]
+        return lambda x: v
+    if node[0] is _Op.CALL:
+        name, obj, args = node[1], _interpreted(node[2]), [_interpreted(a) for a in node[3:]]
+        return lambda x: getattr(obj(x), name)(*(a(x) for a in args))
+    func, args = node[1], [_interpreted(a) for a in node[2:]]
+    return lambda x: func(*(a(x) for a in args))
+
+
+def _compiled(node: tuple[Any, ...]) -> Callable[[Any], Any]:
+    if node[0] is _Op.ELM:
+        return _identity
+    ns: dict[str, Any] = {}
+    try:
+        opt = _optimized(node, {})[0]
+        if opt[0] is _Op.ELM:
+            return _identity
+        return eval(_codegen(_source(opt, ns)), ns)
+    except (RecursionError, SyntaxError, MemoryError):
+        return _interpreted(node)
+
+
+def _node(__x: Any) -> tuple[Any, ...]:
+    return __x._Elm__node if isinstance(__x, Elm) else (_Op.CONST, __x)
+
+
 class Elm:
-    def __init__(self, ret: Callable[..., Any] = lambda x: x) -> None:
-        self.ev = ret
+    def __init__(
+        self,
+        ret: Callable[..., Any] = _identity,
+        cmp: tuple[str, Any] | None = None,
+        node: tuple[Any, ...] | None = None,
+    ) -> None:
+        if node is None:
+            node = _X if ret is _identity else (_Op.FN, ret, _X)
+        self.__node = node
+        # Generated on the first evaluation: the whole expression runs as a single
+        # function, e.g. elm * 2 + 1 becomes lambda x: x.__mul__(2).__add__(1).
+        self.__fn: Callable[[Any], Any] | None = None
+        # Set for the comparisons of the element itself with a constant, such as
+        # elm > 5, so that the streams can recognize cutoffs on ordered sources.
+        self.__cmp = cmp
+
+    @property
+    def ev(self) -> Callable[[Any], Any]:
+        if self.__fn is None:
+            self.__fn = _compiled(self.__node)
+        return self.__fn
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # The generated function is left out, and compiled again on first use.
+        return Elm, (_identity, self.__cmp, self.__node)
+
+    def vectorize(self, values: Any) -> Any:
+        """Evaluates the expression over a whole NumPy array, array.array or list
+        of numbers at once, mapping the operators and the log functions to the
+        NumPy ufuncs, with the NumPy semantics: the result is an array. Without
+        NumPy, or for expressions and values that cannot be mapped, the expression
+        is evaluated on each value and the result is a list."""
+        from ._numpy import evaluate
+
+        res = evaluate(self, values)
+        if res is None:
+            return list(map(self.ev, values))
+        return res
+
+    def __method(self, name: str, *args: Any, cmp: tuple[str, Any] | None = None) -> Elm:
+        return Elm(cmp=cmp, node=(_Op.CALL, name, self.__node, *map(_node, args)))
+
+    def __compared(self, op: str, other: Any) -> tuple[str, Any] | None:
+        return (op, other) if self.__node[0] is _Op.ELM and not isinstance(other, Elm) else None
 
     def __abs__(self) -> Elm:
-        return Elm(lambda x: self.ev(x).__abs__())
+        return self.__method("__abs__")
 
     def __add__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__add__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__add__(other))
+        return self.__method("__add__", other)
 
     def __and__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__and__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__and__(other))
+        return self.__method("__and__", other)
 
     def __contains__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__contains__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__contains__(other))
+        return self.__method("__contains__", other)
 
     def __div__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__div__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__div__(other))
+        return self.__method("__div__", other)
 
     def __divmod__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__divmod__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__divmod__(other))
+        return self.__method("__divmod__", other)
 
     def __eq__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__eq__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__eq__(other))
+        return self.__method("__eq__", other)
 
     def __floordiv__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__floordiv__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__floordiv__(other))
+        return self.__method("__floordiv__", other)
 
     def __ge__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__ge__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__ge__(other))
+        return self.__method("__ge__", other, cmp=self.__compared("ge", other))
 
     def __getattr__(self, __name: str) -> Any:
-        return Elm(lambda x: self.ev(x).__getitem__(__name))
+        # Special and private names are looked up by copy, pickle and the other
+        # protocols, or before __init__ has run: they are never item accesses.
+        if __name.startswith("__") and __name.endswith("__") or __name.startswith("_Elm__"):
+            raise AttributeError(__name)
+        return self.__method("__getitem__", __name)
 
     def __getitem__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__getitem__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__getitem__(other))
+        return self.__method("__getitem__", other)
 
     def __getslice__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__getslice__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__getslice__(other))
+        return self.__method("__getslice__", other)
 
     def __gt__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__gt__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__gt__(other))
+        return self.__method("__gt__", other, cmp=self.__compared("gt", other))
 
     def __hash__(self) -> Elm:
-        return Elm(lambda x: self.ev(x).__hash__())
+        return self.__method("__hash__")
 
     def __hex__(self) -> Elm:
-        return Elm(lambda x: self.ev(x).__hex__())
+        return self.__method("__hex__")
 
     def __invert__(self) -> Elm:
-        return Elm(lambda x: self.ev(x).__invert__())
+        return self.__method("__invert__")
 
     def __le__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__le__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__le__(other))
+        return self.__method("__le__", other, cmp=self.__compared("le", other))
 
     def __len__(self) -> Elm:
-        return Elm(lambda x: self.ev(x).__len__())
+        return self.__method("__len__")
 
     def __lshift__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__lshift__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__lshift__(other))
+        return self.__method("__lshift__", other)
 
     def __lt__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__lt__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__lt__(other))
+        return self.__method("__lt__", other, cmp=self.__compared("lt", other))
 
     def __missing__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__missing__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__missing__(other))
+        return self.__method("__missing__", other)
 
     def __mod__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__mod__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__mod__(other))
+        return self.__method("__mod__", other)
 
     def __mul__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__mul__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__mul__(other))
+        return self.__method("__mul__", other)
 
     def __ne__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__ne__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__ne__(other))
+        return self.__method("__ne__", other)
 
     def __neg__(self) -> Elm:
-        return Elm(lambda x: self.ev(x).__neg__())
+        return self.__method("__neg__")
 
     def __oct__(self) -> Elm:
-        return Elm(lambda x: self.ev(x).__oct__())
+        return self.__method("__oct__")
 
     def __or__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__or__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__or__(other))
+        return self.__method("__or__", other)
 
     def __pos__(self) -> Elm:
-        return Elm(lambda x: self.ev(x).__pos__())
+        return self.__method("__pos__")
 
     def __pow__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__pow__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__pow__(other))
+        return self.__method("__pow__", other)
 
     def __radd__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__radd__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__radd__(other))
+        return self.__method("__radd__", other)
 
     def __rand__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rand__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rand__(other))
+        return self.__method("__rand__", other)
 
     def __rdiv__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rdiv__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rdiv__(other))
+        return self.__method("__rdiv__", other)
 
     def __rdivmod__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rdivmod__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rdivmod__(other))
+        return self.__method("__rdivmod__", other)
 
     def __repr__(self) -> Elm:
-        return Elm(lambda x: self.ev(x).__repr__())
+        return self.__method("__repr__")
 
     def __rfloordiv__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rfloordiv__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rfloordiv__(other))
+        return self.__method("__rfloordiv__", other)
 
     def __rlshift__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rlshift__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rlshift__(other))
+        return self.__method("__rlshift__", other)
 
     def __rmod__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rmod__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rmod__(other))
+        return self.__method("__rmod__", other)
 
     def __rmul__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rmul__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rmul__(other))
+        return self.__method("__rmul__", other)
 
     def __ror__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__ror__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__ror__(other))
+        return self.__method("__ror__", other)
 
     def __rpow__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rpow__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rpow__(other))
+        return self.__method("__rpow__", other)
 
     def __rrshift__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rrshift__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rrshift__(other))
+        return self.__method("__rrshift__", other)
 
     def __rshift__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rshift__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rshift__(other))
+        return self.__method("__rshift__", other)
 
     def __rsub__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rsub__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rsub__(other))
+        return self.__method("__rsub__", other)
 
     def __rtruediv__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rtruediv__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rtruediv__(other))
+        return self.__method("__rtruediv__", other)
 
     def __rxor__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__rxor__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__rxor__(other))
+        return self.__method("__rxor__", other)
 
     # def __setitem__(self, item, value) -> Elm:
     #     if isinstance(other, Elm):
@@ -220,30 +413,25 @@ class Elm:
     #     return Elm(lambda x: self.ev(x).__setitem__(other))
 
     def __setslice__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__setslice__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__setslice__(other))
+        return self.__method("__setslice__", other)
 
     def __str__(self) -> Elm:
-        return Elm(lambda x: self.ev(x).__str__())
+        return self.__method("__str__")
 
     def __sub__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__sub__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__sub__(other))
+        return self.__method("__sub__", other)
 
     def __truediv__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__truediv__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__truediv__(other))
+        return self.__method("__truediv__", other)
 
     def __xor__(self, other) -> Elm:
-        if isinstance(other, Elm):
-            return Elm(lambda x: self.ev(x).__xor__(other.ev(x)))
-        return Elm(lambda x: self.ev(x).__xor__(other))
+        return self.__method("__xor__", other)
 
     def __call__(self, _v):
-        return self.ev(_v)
+        fn = self.__fn
+        if fn is None:
+            fn = self.ev
+        return fn(_v)
 
 
 @overload
@@ -258,7 +446,7 @@ def log2(__x: Elm) -> Elm:
 
 def log2(__x):
     if isinstance(__x, Elm):
-        return Elm(lambda x: math.log2(x))
+        return Elm(node=(_Op.FN, math.log2, _node(__x)))
     return math.log2(__x)
 
 
@@ -274,7 +462,7 @@ def log1p(__x: Elm) -> Elm:
 
 def log1p(__x):
     if isinstance(__x, Elm):
-        return Elm(lambda x: math.log1p(x))
+        return Elm(node=(_Op.FN, math.log1p, _node(__x)))
     return math.log1p(__x)
 
 
@@ -290,7 +478,7 @@ def ln(__x: Elm) -> Elm:
 
 def ln(__x):
     if isinstance(__x, Elm):
-        return Elm(lambda x: math.log(x))
+        return Elm(node=(_Op.FN, math.log, _node(__x)))
     return math.log(__x)
 
 
@@ -306,7 +494,7 @@ def log10(__x: Elm) -> Elm:
 
 def log10(__x):
     if isinstance(__x, Elm):
-        return Elm(lambda x: math.log10(x))
+        return Elm(node=(_Op.FN, math.log10, _node(__x)))
     return math.log10(__x)
 
 
@@ -331,18 +519,30 @@ def log(__x: Elm, base: Elm) -> Elm:
 
 
 def log(__x, base):
-    if isinstance(__x, Elm) and isinstance(base, Elm):
-        return Elm(lambda x: math.log(__x(x), base(x)))
-    if not isinstance(__x, Elm) and isinstance(base, Elm):
-        return Elm(lambda x: math.log(__x, base(x)))
-    if isinstance(__x, Elm) and not isinstance(base, Elm):
-        return Elm(lambda x: math.log(__x(x), base))
+    if isinstance(__x, Elm) or isinstance(base, Elm):
+        return Elm(node=(_Op.FN, math.log, _node(__x), _node(base)))
     return math.log(__x, base)  # type: ignore
 
 
 elm = Elm()
 
 
+def comparison(__x: Any) -> tuple[str, Any] | None:
+    """Returns the operator name and the constant of an elm comparison such as
+    elm > 5, or None for any other object."""
+    if isinstance(__x, Elm):
+        return __x._Elm__cmp
+    return None
+
+
+def compiled(__x: Any) -> Any:
+    """Returns the generated function evaluating an elm expression, or the object
+    itself for any other callable."""
+    if isinstance(__x, Elm):
+        return __x.ev
+    return __x
+
+
 def even(__x: int) -> bool:
     return __x % 2 == 0
 
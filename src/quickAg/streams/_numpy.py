@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import math
+import operator
+from typing import Any, Callable, Iterable, Sequence
+
+from ._batch import _End, _Stage, aslist, vectorized as _many
+from ._elm import Elm, _Op, _optimized, even, odd
+
+try:
+    import numpy as np
+except ModuleNotFoundError:  # pragma: no cover
+    np = None
+
+# Only functions known to be pure and to keep their meaning on arrays are lowered:
+# everything else is opaque and runs on the Python chunk path.
+_PURE: tuple[Callable[..., Any], ...] = (even, odd)
+
+_REDUCERS: tuple[tuple[Callable[..., Any], str], ...] = (
+    (operator.add, "add"),
+    (operator.mul, "multiply"),
+    (int.__add__, "add"),
+    (int.__mul__, "multiply"),
+    (float.__add__, "add"),
+    (float.__mul__, "multiply"),
+    (min, "minimum"),
+    (max, "maximum"),
+)
+
+# The ufunc of each operator of the elm expressions, and whether it is a reflected
+# one, taking its operands in the opposite order.
+_UFUNCS: dict[str, tuple[str, bool]] = {
+    "__add__": ("add", False),
+    "__sub__": ("subtract", False),
+    "__mul__": ("multiply", False),
+    "__truediv__": ("true_divide", False),
+    "__floordiv__": ("floor_divide", False),
+    "__mod__": ("remainder", False),
+    "__pow__": ("power", False),
+    "__and__": ("bitwise_and", False),
+    "__or__": ("bitwise_or", False),
+    "__xor__": ("bitwise_xor", False),
+    "__lshift__": ("left_shift", False),
+    "__rshift__": ("right_shift", False),
+    "__radd__": ("add", True),
+    "__rsub__": ("subtract", True),
+    "__rmul__": ("multiply", True),
+    "__rtruediv__": ("true_divide", True),
+    "__rfloordiv__": ("floor_divide", True),
+    "__rmod__": ("remainder", True),
+    "__rpow__": ("power", True),
+    "__rand__": ("bitwise_and", True),
+    "__ror__": ("bitwise_or", True),
+    "__rxor__": ("bitwise_xor", True),
+    "__rlshift__": ("left_shift", True),
+    "__rrshift__": ("right_shift", True),
+    "__eq__": ("equal", False),
+    "__ne__": ("not_equal", False),
+    "__lt__": ("less", False),
+    "__le__": ("less_equal", False),
+    "__gt__": ("greater", False),
+    "__ge__": ("greater_equal", False),
+    "__neg__": ("negative", False),
+    "__pos__": ("positive", False),
+    "__abs__": ("absolute", False),
+    "__invert__": ("invert", False),
+}
+
+_FUNCS: tuple[tuple[Callable[..., Any], str], ...] = (
+    (math.log, "log"),
+    (math.log2, "log2"),
+    (math.log10, "log10"),
+    (math.log1p, "log1p"),
+)
+
+
+class _NoUfunc(Exception):
+    ...
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _lowerable(func: Callable[..., Any]) -> bool:
+    return isinstance(func, Elm) or any(func is f for f in _PURE)
+
+
+# Ints at or beyond this bound may have wrapped around in int64.
+_INTBOUND = 2.0**62
+
+# The ufuncs whose int results are bounded by their operands, so they cannot
+# overflow when the operands did not. Their shadow is the exact result: computed
+# from the rounded shadows of the operands, a remainder or a quotient could be
+# far from it.
+_BOUNDED = (
+    "bitwise_and",
+    "bitwise_or",
+    "bitwise_xor",
+    "invert",
+    "right_shift",
+    "remainder",
+    "floor_divide",
+)
+
+
+def _lower(node: tuple[Any, ...], a: Any, af: Any, memo: dict[int, Any]) -> tuple[Any, Any]:
+    # Returns the result of the node, and its float64 shadow when the values are
+    # ints: the same operations in floats, which do not wrap around, so that an
+    # int result whose shadow is out of _INTBOUND overflowed. Shared subtrees are
+    # evaluated once.
+    if node[0] is _Op.ELM:
+        return a, af
+    if node[0] is _Op.CONST:
+        return node[1], node[1]
+    if id(node) in memo:
+        return memo[id(node)]
+    if node[0] is _Op.FN:
+        name = next((n for f, n in _FUNCS if node[1] is f), None)
+        if name is None:
+            raise _NoUfunc
+        args = [_lower(x, a, af, memo)[0] for x in node[2:]]
+        # math.log(x, base) is the only function with a second argument.
+        r = getattr(np, name)(args[0]) if len(args) == 1 else np.log(args[0]) / np.log(args[1])
+        f = r
+    else:
+        if node[1] not in _UFUNCS:
+            raise _NoUfunc
+        name, reflected = _UFUNCS[node[1]]
+        pairs = [_lower(x, a, af, memo) for x in node[2:]]
+        if reflected:
+            pairs.reverse()
+        r = getattr(np, name)(*(x for x, _ in pairs))
+        f = None
+        if af is not None and np.ndim(r) and r.dtype.kind in "iu":
+            if name in _BOUNDED:
+                f = r.astype(np.float64)
+            elif name == "left_shift":
+                f = pairs[0][1] * np.exp2(pairs[1][1])
+            else:
+                with np.errstate(all="ignore"):
+                    f = getattr(np, name)(*(y for _, y in pairs))
+            if not (np.abs(f) < _INTBOUND).all():
+                raise _NoUfunc
+    memo[id(node)] = r, f
+    return r, f
+
+
+def evaluate(expr: Elm, values: Any) -> Any:
+    """Evaluates an elm expression over a whole array of numbers with the NumPy
+    ufuncs, returning the resulting array, or None if NumPy is not installed, the
+    values are not numeric, the expression has operations without a ufunc or an
+    int result might not fit in 64 bits."""
+    if np is None:
+        return None
+    try:
+        a = values if isinstance(values, np.ndarray) else np.asarray(values)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if a.dtype.kind not in "biuf":
+        return None
+    af = a.astype(np.float64) if a.dtype.kind in "iu" else None
+    try:
+        r = _lower(_optimized(expr._Elm__node, {})[0], a, af, {})[0]
+    except (_NoUfunc, TypeError, ValueError, OverflowError):
+        return None
+    return r if np.ndim(r) else np.full(a.shape, r)
+
+
+def intsum(a: Any) -> Any:
+    """The sum of an array as a Python number, computed in Python when the sum of
+    an int array might not fit in 64 bits."""
+    if a.dtype.kind in "iu" and not np.abs(a.astype(np.float64)).sum() < _INTBOUND:
+        return sum(a.tolist())
+    return a.sum().item()
+
+
+def _asarray(chunk: Any) -> Any:
+    if chunk.__class__ is not list:
+        return chunk
+    if not chunk:
+        return None
+    # Mixed or non numeric chunks would be coerced to a common dtype, changing the
+    # values, so only homogeneous int and float chunks are converted.
+    types = set(map(type, chunk))
+    if len(types) != 1 or types.pop() not in (int, float):
+        return None
+    try:
+        a = np.asarray(chunk)
+    except (OverflowError, ValueError):
+        return None
+    if a.dtype.kind not in "if":
+        return None
+    return a
+
+
+def _apply(func: Callable[[Any], Any], a: Any) -> Any:
+    if not len(a):
+        return a
+    try:
+        with np.errstate(all="raise"):
+            # An elm expression that cannot be lowered, or that might overflow, is
+            # left to the Python path rather than run on the array as is.
+            r = evaluate(func, a) if isinstance(func, Elm) else func(a)
+    except Exception:
+        return None
+    if not isinstance(r, np.ndarray) or r.shape != a.shape or r.dtype.kind not in "biuf":
+        return None
+    # The first element is also evaluated in Python: a different type or value means
+    # that the operation has a different meaning on arrays, such as broadcasting
+    # against a sequence operand.
+    try:
+        p = func(a[0].item())
+    except Exception:
+        return None
+    q = r[0].item()
+    if type(p) is not type(q) or not (p == q or (p != p and q != q)):
+        return None
+    return r
+
+
+def _fallback(stage: _Stage, chunk: Any, clean: bool) -> tuple[Any, bool, _End]:
+    return stage(aslist(chunk), clean)
+
+
+def _eval(func: Callable[[Any], Any], py: _Stage) -> _Stage:
+    def stage(chunk: Any, clean: bool) -> tuple[Any, bool, _End]:
+        if clean and (a := _asarray(chunk)) is not None:
+            r = _apply(func, a)
+            if r is not None:
+                return r, True, None
+        return _fallback(py, chunk, clean)
+
+    return stage
+
+
+def _filter(key: Callable[[Any], Any], keep: bool, py: _Stage) -> _Stage:
+    def stage(chunk: Any, clean: bool) -> tuple[Any, bool, _End]:
+        if clean and (a := _asarray(chunk)) is not None:
+            m = _apply(key, a)
+            if m is not None:
+                m = m.astype(bool)
+                return a[m if keep else ~m], True, None
+        return _fallback(py, chunk, clean)
+
+    return stage
+
+
+def _manyfilter(many: Callable[[Any], Any], keep: bool, py: _Stage) -> _Stage:
+    # Only int arrays: the chunk versions are exact on ints, while the Python path
+    # keeps the behavior of the function on floats.
+    def stage(chunk: Any, clean: bool) -> tuple[Any, bool, _End]:
+        if clean and (a := _asarray(chunk)) is not None and a.dtype.kind == "i":
+            m = many(a)
+            return a[m if keep else ~m], True, None
+        return _fallback(py, chunk, clean)
+
+    return stage
+
+
+def _stop(key: Callable[[Any], Any], after: bool, py: _Stage) -> _Stage:
+    def stage(chunk: Any, clean: bool) -> tuple[Any, bool, _End]:
+        if clean and (a := _asarray(chunk)) is not None:
+            m = _apply(key, a)
+            if m is not None:
+                idx = np.flatnonzero(m)
+                if not len(idx):
+                    return a, True, None
+                k = int(idx[0])
+                return a[:k], True, [a[k].item()] if after else []
+        return _fallback(py, chunk, clean)
+
+    return stage
+
+
+def _slicing(py: _Stage) -> _Stage:
+    # limit, skip and the exception handlers only slice or pass clean chunks, which
+    # works the same on arrays.
+    def stage(chunk: Any, clean: bool) -> tuple[Any, bool, _End]:
+        if clean:
+            return py(chunk, clean)
+        return _fallback(py, chunk, clean)
+
+    return stage
+
+
+def _python(py: _Stage) -> _Stage:
+    def stage(chunk: Any, clean: bool) -> tuple[Any, bool, _End]:
+        return _fallback(py, chunk, clean)
+
+    return stage
+
+
+def vectorized(spec: Sequence[tuple[Any, ...]], stages: Sequence[_Stage]) -> list[_Stage]:
+    """Wraps the chunk stages so that the ones built from Elm expressions run on
+    NumPy arrays, falling back to the given Python stages for every chunk or
+    expression that cannot be lowered."""
+    out: list[_Stage] = []
+    for s, py in zip(spec, stages):
+        match s:
+            case ("eval", func) if _lowerable(func):
+                out.append(_eval(func, py))
+            case ("filter", key) if _lowerable(key):
+                out.append(_filter(key, True, py))
+            case ("filterout", key) if _lowerable(key):
+                out.append(_filter(key, False, py))
+            case ("filter", key) if _many(key) is not None:
+                out.append(_manyfilter(_many(key), True, py))
+            case ("filterout", key) if _many(key) is not None:
+                out.append(_manyfilter(_many(key), False, py))
+            case ("stop", key) if _lowerable(key):
+                out.append(_stop(key, False, py))
+            case ("stopafter", key) if _lowerable(key):
+                out.append(_stop(key, True, py))
+            case ("limit" | "skip" | "exc" | "excg", *_):
+                out.append(_slicing(py))
+            case _:
+                out.append(_python(py))
+    return out
+
+
+def reducer(func: Callable[..., Any]) -> Any:
+    """Returns the ufunc equivalent to the given reduction function, if any."""
+    if np is None:
+        return None
+    for f, name in _REDUCERS:
+        if func is f:
+            return getattr(np, name)
+    return None
+
+
+def reduce(func: Callable[[Any, Any], Any], ufunc: Any, chunks: Iterable[Any], default: Any) -> Any:
+    # Partial results are only combined for the known associative reducers, any
+    # other function is folded left to right over the elements.
+    res = empty = object()
+    for chunk in chunks:
+        if not len(chunk):
+            continue
+        # Int products overflow too easily to be worth a bound check.
+        if ufunc is not None and chunk.__class__ is not list and (ufunc is not np.multiply or chunk.dtype.kind == "f"):
+            part = intsum(chunk) if ufunc is np.add else ufunc.reduce(chunk).item()
+            res = part if res is empty else func(res, part)
+            continue
+        it = iter(aslist(chunk))
+        if res is empty:
+            res = next(it)
+        for v in it:
+            res = func(res, v)
+    return default if res is empty else res
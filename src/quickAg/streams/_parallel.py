@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import pickle
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from typing import Any, Callable, Iterator
+
+from ._result import StreamResult, _SFlow
+
+
+def _task(func: Callable[[Any], Any], vals: list[Any]) -> list[tuple[bool, Any]]:
+    # Runs in the workers: it must stay a module level function to be picklable.
+    out: list[tuple[bool, Any]] = []
+    for v in vals:
+        try:
+            out.append((True, func(v)))
+        except Exception as exc:
+            out.append((False, exc))
+    return out
+
+
+def _unpickled(payload: bytes) -> list[tuple[bool, Any]]:
+    return _task(*pickle.loads(payload))
+
+
+def _results(vals: list[Any], fut: Future) -> list[StreamResult]:
+    try:
+        res = fut.result()
+    except Exception as exc:
+        # The task itself failed, e.g. the function could not be pickled or the
+        # pool broke: every element of the task carries the exception.
+        return [StreamResult(v, exc, _SFlow.EXCP) for v in vals]
+    return [
+        StreamResult(r) if ok else StreamResult(v, r, _SFlow.EXCP)
+        for v, (ok, r) in zip(vals, res)
+    ]
+
+
+def mapped(
+    src: Iterator[StreamResult],
+    func: Callable[[Any], Any],
+    executor: Callable[[], Executor],
+    window: int,
+    chunksize: int,
+    ordered: bool,
+    pickled: bool = False,
+) -> Iterator[StreamResult]:
+    """Evaluates func on the elements of the source in the given executor, keeping
+    at most window tasks of chunksize elements in flight. Elements that already
+    carry an exception are passed along without being submitted, and count
+    toward the window while they wait behind a task, so that the source is never
+    read more than window tasks ahead. Closing the generator cancels the pending
+    tasks. Executors running in other processes need pickled set, so that the
+    tasks are pickled before being submitted."""
+    ex = executor()
+    pending: deque[tuple[list[Any], Future | None, list[StreamResult]]] = deque()
+    done = False
+    try:
+        while True:
+            while not done and len(pending) < window:
+                vals: list[Any] = []
+                ready: list[StreamResult] = []
+                while len(vals) < chunksize:
+                    e = next(src, None)
+                    if e is None:
+                        done = True
+                        break
+                    if e.flw is not _SFlow.NORM or e.exc is not None:
+                        ready.append(e)
+                        break
+                    vals.append(e.val)
+                if vals and not pickled:
+                    pending.append((vals, ex.submit(_task, func, vals), []))
+                elif vals:
+                    # The task is pickled here rather than in the feeder thread of
+                    # the pool, where a failure would leave the pool unable to shut
+                    # down: an unpicklable task fails its elements instead.
+                    try:
+                        payload = pickle.dumps((func, vals))
+                    except Exception as exc:
+                        pending.append(([], None, [StreamResult(v, exc, _SFlow.EXCP) for v in vals]))
+                    else:
+                        pending.append((vals, ex.submit(_unpickled, payload), []))
+                if ready and ordered and pending:
+                    pending.append(([], None, ready))
+                elif ready:
+                    yield from ready
+            if not pending:
+                return
+            if ordered:
+                vals, fut, ready = pending.popleft()
+            else:
+                i = next((i for i, (_, f, _) in enumerate(pending) if f is None), None)
+                if i is None:
+                    finished = wait([f for _, f, _ in pending], return_when=FIRST_COMPLETED).done
+                    i = next(i for i, (_, f, _) in enumerate(pending) if f in finished)
+                vals, fut, ready = pending[i]
+                del pending[i]
+            if fut is not None:
+                yield from _results(vals, fut)
+            yield from ready
+    finally:
+        for _, f, _ in pending:
+            if f is not None:
+                f.cancel()
+        ex.shutdown(wait=False, cancel_futures=True)
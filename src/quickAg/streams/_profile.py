@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import os
+import sys
+from dataclasses import dataclass, field
+from time import perf_counter_ns
+from typing import Any, Callable, Iterator, Sequence
+
+from ._result import StreamResult, _SFlow
+
+# Setting the variable to anything but "" or "0" before the import profiles every
+# stream, printing the report of each one to stderr when it stops, or when it is
+# collected or the interpreter exits if it never does. The streams that are the
+# source of another stream do not report on their own.
+ENV = "QUICKAG_PROFILE"
+ENABLED = os.environ.get(ENV, "") not in ("", "0")
+
+
+def emit(profile: Profile) -> None:
+    print(profile, file=sys.stderr)
+
+
+@dataclass(slots=True)
+class StageStats:
+    """Counters of a single stage. Elements enter a stage in the NORM flow, or in
+    the EXCP flow for the handlers that act on them, and leave it either passed
+    along (out), skipped, stopping the stream (a stopafter element is both out
+    and stopped) or raising. time is the cumulative wall time in nanoseconds, and
+    hist[k] counts the elements that took between 2**(k-1) and 2**k nanoseconds."""
+
+    name: str
+    ein: int = 0
+    out: int = 0
+    skipped: int = 0
+    stopped: int = 0
+    raised: int = 0
+    time: int = 0
+    hist: list[int] = field(default_factory=lambda: [0] * 65, repr=False)
+
+    @property
+    def mean(self) -> float:
+        """The mean latency per element, in nanoseconds."""
+        return self.time / self.ein if self.ein else 0.0
+
+    def quantile(self, q: float) -> int:
+        """The upper bound, in nanoseconds, of the histogram bucket holding the
+        q-th quantile of the latencies."""
+        rank, seen = q * self.ein, 0
+        for k, n in enumerate(self.hist):
+            seen += n
+            if n and seen >= rank:
+                return 1 << k
+        return 0
+
+
+def _label(spec: tuple[Any, ...]) -> str:
+    if not spec:
+        return "evr"
+    args = []
+    for a in spec[1:]:
+        # Elm expressions have no name, and map every other attribute to an item.
+        name = "elm" if a.__class__.__name__ == "Elm" else getattr(a, "__name__", None)
+        args.append(name if isinstance(name, str) else repr(a))
+    return f"{spec[0]}({', '.join(args)})"
+
+
+def _us(ns: float) -> str:
+    return f"{ns / 1000:.2f}"
+
+
+@dataclass(slots=True)
+class Profile:
+    """The per stage report of a profiled stream, in the order of the stages.
+    str() formats it as a table, with the latencies in microseconds."""
+
+    stages: list[StageStats] = field(default_factory=list)
+    _index: dict[int, StageStats] = field(default_factory=dict, repr=False)
+
+    def stage(self, w: object, spec: tuple[Any, ...]) -> StageStats:
+        st = self._index.get(id(w))
+        if st is None:
+            st = self._index[id(w)] = StageStats(f"{len(self.stages)} {_label(spec)}")
+            self.stages.append(st)
+        return st
+
+    def wrap(
+        self, stack: Sequence[Callable[[StreamResult], StreamResult]], spec: Sequence[tuple[Any, ...]]
+    ) -> list[Callable[[StreamResult], StreamResult]]:
+        """Returns the stages wrapped so that each one updates its counters."""
+        return [_profiled(w, self.stage(w, s)) for w, s in zip(stack, spec)]
+
+    @property
+    def time(self) -> int:
+        return sum(st.time for st in self.stages)
+
+    def __str__(self) -> str:
+        head = ("stage", "in", "out", "skip", "stop", "exc", "total ms", "mean us", "p50 us", "p99 us")
+        rows = [
+            (
+                st.name,
+                str(st.ein),
+                str(st.out),
+                str(st.skipped),
+                str(st.stopped),
+                str(st.raised),
+                f"{st.time / 1e6:.3f}",
+                _us(st.mean),
+                _us(st.quantile(0.5)),
+                _us(st.quantile(0.99)),
+            )
+            for st in self.stages
+        ]
+        widths = [max(len(r[i]) for r in (head, *rows)) for i in range(len(head))]
+        lines = [
+            "  ".join(c.ljust(w) if i == 0 else c.rjust(w) for i, (c, w) in enumerate(zip(r, widths)))
+            for r in (head, *rows)
+        ]
+        return "\n".join(lines)
+
+
+def _profiled(w: Callable[[StreamResult], StreamResult], st: StageStats) -> Callable[[StreamResult], StreamResult]:
+    NORM, SKIP, STOP, STAF, EXCP = _SFlow.NORM, _SFlow.SKIP, _SFlow.STOP, _SFlow.STAF, _SFlow.EXCP
+    hist = st.hist
+
+    def stage(e: StreamResult) -> StreamResult:
+        f = e.flw
+        if f is not NORM and f is not EXCP:
+            return w(e)
+        t = perf_counter_ns()
+        r = w(e)
+        dt = perf_counter_ns() - t
+        g = r.flw
+        if f is EXCP and g is EXCP:
+            # Passed along by a stage that does not handle exceptions.
+            return r
+        st.ein += 1
+        st.time += dt
+        hist[dt.bit_length()] += 1
+        if g is NORM:
+            st.out += 1
+        elif g is SKIP:
+            st.skipped += 1
+        elif g is EXCP:
+            st.raised += 1
+        else:
+            st.stopped += 1
+            st.out += g is STAF
+        return r
+
+    return stage
+
+
+class Tap:
+    """The source of a rebased stream, pulling from its look-ahead stage, such as
+    pmap. Once attached to a profile the stage is timed as a whole: the time of
+    each pull, less the time the stages before it took meanwhile."""
+
+    def __init__(self, gen: Iterator[StreamResult], spec: tuple[Any, ...]) -> None:
+        self.gen = gen
+        self.spec = spec
+        self.pull: Callable[[], StreamResult] = gen.__next__
+
+    def __iter__(self) -> Tap:
+        return self
+
+    def __next__(self) -> StreamResult:
+        return self.pull()
+
+    def attach(self, profile: Profile) -> None:
+        st = profile.stage(self, self.spec)
+        pull, hist, EXCP = self.gen.__next__, st.hist, _SFlow.EXCP
+
+        def timed() -> StreamResult:
+            t, before = perf_counter_ns(), profile.time
+            r = pull()
+            dt = max(perf_counter_ns() - t - (profile.time - before), 0)
+            st.ein += 1
+            st.time += dt
+            hist[dt.bit_length()] += 1
+            if r.flw is EXCP:
+                st.raised += 1
+            else:
+                st.out += 1
+            return r
+
+        self.pull = timed
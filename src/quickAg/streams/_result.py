@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import Generic, TypeVar
+
+
+class _SFlow(Enum):
+    NORM = 0
+    SKIP = 1
+    STOP = 2
+    STAF = 3
+    EXCP = 4
+
+
+_T = TypeVar("_T")
+
+
+@dataclass(slots=True)
+class StreamResult(Generic[_T]):
+    val: _T
+    exc: Exception | None = None
+    flw: _SFlow = _SFlow.NORM
+
+
+# class StreamResult(NamedTuple, Generic[_T]):
+#     val: _T
+#     exc: Exception | None
+#     flw: _SFlow
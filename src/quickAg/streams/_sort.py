@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import pickle
+import sys
+import tempfile
+from heapq import merge, nlargest, nsmallest
+from itertools import islice
+from typing import IO, Any, Callable, Iterable, Iterator
+
+from ._result import StreamResult, _SFlow
+
+
+# At most _FANIN runs are merged at once, so that the number of open files and the
+# memory held by their read buffers stay bounded.
+_FANIN = 64
+
+
+def ordered(
+    src: Iterator[StreamResult],
+    key: Callable[[Any], Any] | None,
+    reverse: bool,
+    limit: int | None,
+) -> Iterator[StreamResult]:
+    """Yields the elements of the source in sorted order, once it is exhausted.
+    With a limit only the first limit elements of the order are kept, in a heap
+    of that size. Elements that carry an exception cannot be ordered: they are
+    yielded first, in the order they came."""
+    failed: list[StreamResult] = []
+
+    def values() -> Iterator[Any]:
+        for e in src:
+            if e.flw is not _SFlow.NORM or e.exc is not None:
+                failed.append(e)
+            else:
+                yield e.val
+
+    if limit is None:
+        res = sorted(values(), key=key, reverse=reverse)
+    else:
+        res = (nlargest if reverse else nsmallest)(limit, values(), key=key)
+    yield from failed
+    for v in res:
+        yield StreamResult(v)
+
+
+def _size(val: Any) -> int:
+    # A shallow estimate, looking one level into the builtin containers.
+    size = sys.getsizeof(val) + 8
+    if val.__class__ in (tuple, list):
+        size += sum(map(sys.getsizeof, val))
+    elif val.__class__ is dict:
+        size += sum(map(sys.getsizeof, val.values()))
+    return size
+
+
+def _spill(vals: Iterable[Any], batch: int, dir: str | None) -> IO[bytes]:
+    f = tempfile.TemporaryFile(dir=dir)
+    try:
+        it = iter(vals)
+        while chunk := list(islice(it, batch)):
+            pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+        f.seek(0)
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+
+def _run(f: IO[bytes]) -> Iterator[Any]:
+    while True:
+        try:
+            chunk = pickle.load(f)
+        except EOFError:
+            return
+        yield from chunk
+
+
+def _merged(
+    runs: list[IO[bytes]], key: Callable[[Any], Any] | None, reverse: bool, batch: int, dir: str | None
+) -> IO[bytes]:
+    try:
+        return _spill(merge(*map(_run, runs), key=key, reverse=reverse), batch, dir)
+    finally:
+        for f in runs:
+            f.close()
+
+
+def external(
+    src: Iterator[StreamResult],
+    key: Callable[[Any], Any] | None,
+    reverse: bool,
+    memory_limit: int,
+    dir: str | None = None,
+) -> Iterator[StreamResult]:
+    """Yields the elements of the source in sorted order, spilling sorted runs to
+    temporary files whenever the estimated size of the buffered values exceeds
+    half of memory_limit bytes, and merging the runs lazily. The runs are read
+    back in batches sized so that the batches of _FANIN runs take the other half.
+    Every _FANIN runs of a level are merged into one run of the next level, so
+    each value is written about log(runs) / log(_FANIN) times. The order is
+    stable, and the elements carrying an exception come first, as in ordered. The
+    temporary files are deleted as soon as the generator is exhausted or closed."""
+    failed: list[StreamResult] = []
+    # levels[k] holds the runs merged from _FANIN ** k buffers, in the order they
+    # were made. The higher levels hold the older values, so they come first in
+    # the final merge, which keeps the sort stable.
+    levels: list[list[IO[bytes]]] = []
+    buf: list[Any] = []
+    used = spilled = count = 0
+    batch = 1
+    try:
+        for e in src:
+            if e.flw is not _SFlow.NORM or e.exc is not None:
+                failed.append(e)
+                continue
+            buf.append(e.val)
+            used += _size(e.val)
+            if used > memory_limit // 2:
+                spilled, count = spilled + used, count + len(buf)
+                batch = max(1, memory_limit // 2 // (_FANIN * (spilled // count)))
+                buf.sort(key=key, reverse=reverse)
+                run = _spill(buf, batch, dir)
+                buf, used = [], 0
+                for level in levels:
+                    level.append(run)
+                    if len(level) < _FANIN:
+                        break
+                    run = _merged(level[:], key, reverse, batch, dir)
+                    level.clear()
+                else:
+                    levels.append([run])
+        yield from failed
+        buf.sort(key=key, reverse=reverse)
+        runs = [f for level in reversed(levels) for f in level]
+        levels = [runs]  # for the cleanup
+        while len(runs) > _FANIN:
+            # The newest runs are merged first, keeping the runs in order.
+            runs[-_FANIN:] = [_merged(runs[-_FANIN:], key, reverse, batch, dir)]
+        if not runs:
+            for v in buf:
+                yield StreamResult(v)
+            return
+        for v in merge(*map(_run, runs), buf, key=key, reverse=reverse):
+            yield StreamResult(v)
+    finally:
+        for level in levels:
+            for f in level:
+                f.close()
@@ -1,69 +1,232 @@
 from __future__ import annotations
-from ..math.primes import primes
+from ..math.primes import primepi, primes
+from ..structs.caches import BloomFilter
+from . import _aggregate, _numpy, _profile
+from ._async import AsyncStream
+from ._batch import aslist, chunked
+from ._compile import _Fault, fuse, plain
+from ._elm import comparison
+from ._parallel import mapped
+from ._profile import Profile
+from ._result import StreamResult, _SFlow
+from ._sort import external, ordered
 
-from enum import Enum
 from typing import (
     Any,
+    AsyncIterable,
     Callable,
+    Generator,
     Generic,
     Iterable,
     Iterator,
     Literal,
+    MutableMapping,
+    MutableSet,
     TypeVar,
 )
-from itertools import count, zip_longest
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import count, islice, zip_longest
 from random import random, randint
-from dataclasses import dataclass
-
-
-class _SFlow(Enum):
-    NORM = 0
-    SKIP = 1
-    STOP = 2
-    STAF = 3
-    EXCP = 4
 
 
 _T = TypeVar("_T")
 _R = TypeVar("_R")
 _D = TypeVar("_D")
 
-
-@dataclass(slots=True)
-class StreamResult(Generic[_T]):
-    val: _T
-    exc: Exception | None = None
-    flw: _SFlow = _SFlow.NORM
-
-
-# class StreamResult(NamedTuple, Generic[_T]):
-#     val: _T
-#     exc: Exception | None
-#     flw: _SFlow
+_NODEFAULT: Any = object()
 
 
 class Stream(Iterator[_T], Generic[_T]):
-    def __init__(self, __iter: Iterable[_T], *, forceraw: bool = False):
+    def __init__(
+        self, __iter: Iterable[_T], *, forceraw: bool = False, counter: Callable[[Any], int] | None = None
+    ):
         if isinstance(__iter, Stream) or forceraw:
+            self.__src = None
             self.__iter = __iter  # type: ignore
         else:
-            self.__iter = (StreamResult(e) for e in __iter)
+            self.__src = iter(__iter)
+            self.__iter = (StreamResult(e) for e in self.__src)
         self.__iter: Iterator[StreamResult[_T]]
 
         self.__stack: list[Callable[[StreamResult], StreamResult]] = []
+        self.__spec: list[tuple[Any, ...]] = []
+        self.__run: list[Callable[[StreamResult], StreamResult]] | None = None
+        self.__engine: Callable[[Callable[[StreamResult], Any]], Iterator[Any]] | None = None
+        self.__cursor: Iterator[Any] | None = None
+        self.__batch: int = 0
+        self.__backend: str = "python"
         self.__status: _SFlow = _SFlow.NORM
+        self.__onstop: Callable[[], Any] | None = None
+        # For increasing sources, counts the source elements up to a value. It is
+        # only valid until the stream starts, which compiles it.
+        self.__counter = counter
+        # Profiled streams run every stage on its own, wrapped to update its
+        # counters, rather than through the fused, plain or batched engines.
+        self.__report = _profile.ENABLED
+        self.__reporter: weakref.finalize | None = None
+        self.__profile: Profile | None = Profile() if self.__report else None
+        self.__inner: Stream[Any] | None = None
+        self.__tap: _profile.Tap | None = None
 
     def __iter__(self) -> Iterator[_T]:
         return self
 
     def __next__(self) -> _T:
+        if self.__run is None:
+            self.compile()
+        if self.__engine is not None:
+            if self.__cursor is None:
+                self.__cursor = self.__values(_Fault)
+            v = next(self.__cursor)
+            if v.__class__ is _Fault:
+                raise RuntimeError(v.res)
+            return v
+
         e = self._next_raw_()
 
         if e.flw != _SFlow.NORM:
             raise RuntimeError(e)
         return e.val
 
+    def __push(self, w: Callable[[StreamResult], StreamResult], *spec: Any) -> None:
+        self.__stack.append(w)
+        self.__spec.append(spec)
+        self.__run = None
+
+    def compile(self) -> Stream[_T]:
+        self.__counter = None
+        if self.__profile is not None:
+            if self.__report and self.__reporter is None:
+                self.__reporter = weakref.finalize(self, _profile.emit, self.__profile)
+            self.__run = self.__profile.wrap(self.__stack, self.__spec)
+            self.__engine = None
+            self.__cursor = None
+            return self
+        self.__run = fuse(self.__stack, self.__spec)
+        if self.__batch:
+            # The cursor may hold the rest of a chunk, so it is kept: the new stages
+            # apply from the next chunk on.
+            self.__chunk = chunked(self.__stack, self.__spec)
+            if self.__backend == "numpy" and _numpy.available():
+                self.__chunk = _numpy.vectorized(self.__spec, self.__chunk)
+            self.__engine = self.__batches
+            return self
+        self.__engine = None
+        self.__cursor = None
+        if self.__src is not None:
+            gen = plain(self.__stack, self.__spec)
+            if gen is not None:
+                self.__engine = partial(gen, self.__src)
+        return self
+
+    def batched(self, num: int, backend: Literal["python", "numpy"] = "python") -> Stream[_T]:
+        if num < 1:
+            raise ValueError("The batch size must be at least 1")
+        if backend not in ("python", "numpy"):
+            raise ValueError(f"Unknown backend {backend!r}")
+        self.__batch = num
+        self.__backend = backend
+        self.__run = None
+        self.__cursor = None
+        return self
+
+    def profile(self) -> Stream[_T]:
+        if self.__profile is None:
+            self.__attach(Profile())
+        return self
+
+    def __attach(self, profile: Profile) -> None:
+        # The stages moved to an inner stream by a rebase come first in the report.
+        if self.__inner is not None:
+            self.__inner.__attach(profile)
+            self.__tap.attach(profile)  # type: ignore
+        profile.wrap(self.__stack, self.__spec)
+        self.__profile = profile
+        self.__run = None
+
+    @property
+    def report(self) -> Profile | None:
+        return self.__profile
+
+    def __values(self, fault: Callable[[StreamResult], Any]) -> Iterator[Any]:
+        # Every generator pulls from the shared source and keeps the stage state in
+        # the stages, without reading ahead, so several of them can coexist.
+        if self.__status == _SFlow.STOP:
+            return
+        yield from self.__engine(fault)  # type: ignore
+        self.__stop()
+
+    def __pull(self, num: int) -> tuple[list[Any], bool]:
+        if self.__src is not None:
+            chunk = list(islice(self.__src, num))
+            return chunk, len(chunk) < num
+        chunk = []
+        for e in islice(self.__iter, num):
+            match e.flw:
+                case _SFlow.NORM:
+                    chunk.append(e.val)
+                case _SFlow.EXCP:
+                    chunk.append(_Fault(e))
+                case _SFlow.STOP:
+                    return chunk, True
+        return chunk, len(chunk) < num
+
+    def __chunks(self) -> Iterator[tuple[list[Any], bool]]:
+        while self.__status != _SFlow.STOP:
+            chunk, stop = self.__pull(self.__batch)
+            clean = self.__src is not None or not any(v.__class__ is _Fault for v in chunk)
+            tail = None
+            for stage in self.__chunk:
+                chunk, clean, end = stage(chunk, clean)
+                if end is not None:
+                    tail = end
+            if tail is not None:
+                chunk = aslist(chunk)
+                chunk.extend(tail)
+                stop = True
+            if stop:
+                self.__stop()
+            yield chunk, clean
+
+    def __batches(self, fault: Callable[[StreamResult], Any]) -> Iterator[Any]:
+        for chunk, clean in self.__chunks():
+            if clean:
+                yield from aslist(chunk)
+                continue
+            for v in chunk:
+                yield fault(v.res) if v.__class__ is _Fault else v
+
+    def __cleanchunks(self) -> Iterator[Any] | None:
+        # Whole chunks can only be consumed if no element of the current one has
+        # been handed out already.
+        if self.__run is None:
+            self.compile()
+        if not self.__batch or self.__cursor is not None or self.__profile is not None:
+            return None
+        return self.__cleanchunks_()
+
+    def __cleanchunks_(self) -> Iterator[Any]:
+        for chunk, clean in self.__chunks():
+            if not clean:
+                for i, v in enumerate(chunk):
+                    if v.__class__ is _Fault:
+                        yield chunk[:i]
+                        raise RuntimeError(v.res)
+            yield chunk
+
     def _next_raw_(self) -> StreamResult:
+        if self.__run is None:
+            self.compile()
+        if self.__engine is not None:
+            if self.__cursor is None:
+                self.__cursor = self.__values(_Fault)
+            v = next(self.__cursor)
+            if v.__class__ is _Fault:
+                return v.res
+            return StreamResult(v)
         while True:
             if self.__status == _SFlow.STOP:
                 raise StopIteration
@@ -73,7 +236,7 @@ class Stream(Iterator[_T], Generic[_T]):
             except StopIteration:
                 e = StreamResult(None, None, _SFlow.STOP)
 
-            for ev in self.__stack:
+            for ev in self.__run:  # type: ignore
                 e = ev(e)
 
             match e.flw:
@@ -82,14 +245,55 @@ class Stream(Iterator[_T], Generic[_T]):
                 case _SFlow.NORM:
                     return e
                 case _SFlow.STOP:
+                    self.__stop()
                     raise StopIteration
                 case _SFlow.STAF:
-                    self.__status = _SFlow.STOP
+                    self.__stop()
                     return StreamResult(e.val, e.exc, _SFlow.NORM)
                 case _SFlow.EXCP:
                     return e
 
+    def __stop(self) -> None:
+        if self.__reporter is not None:
+            # Prints the report, once.
+            self.__reporter()
+        self.__status = _SFlow.STOP
+        if self.__onstop is not None:
+            self.__onstop()
+
+    def __rebase(
+        self, gen: Callable[[Iterator[StreamResult]], Generator[StreamResult, None, None]], *spec: Any
+    ) -> None:
+        # The stages so far move to an inner stream, which becomes the source of a
+        # stage that needs to look ahead. The stream keeps its identity and mode,
+        # and closes that stage as soon as it stops, cancelling its pending work.
+        inner = object.__new__(Stream)
+        inner.__dict__.update(self.__dict__)
+        inner.__run = None
+        inner.__cursor = None
+        inner.__report = False
+        inner.__reporter = None
+        batch, backend, profile, reporter = self.__batch, self.__backend, self.__profile, self.__reporter
+        src = gen(inner._iter_raw_())
+        tap = _profile.Tap(src, spec)
+        if profile is not None:
+            # Registers the inner stages first, so that the report keeps their order.
+            profile.wrap(self.__stack, self.__spec)
+            tap.attach(profile)
+        Stream.__init__(self, tap, forceraw=True)
+        self.__batch, self.__backend, self.__profile, self.__reporter = batch, backend, profile, reporter
+        self.__inner = inner
+        self.__tap = tap
+        self.__onstop = src.close
+
     def _iter_raw_(self) -> Iterator[StreamResult[_T]]:
+        # A stream read raw is the source of another stream, which reports instead.
+        self.__report = False
+        if self.__reporter is not None:
+            self.__reporter.detach()
+        return self.__raw()
+
+    def __raw(self) -> Iterator[StreamResult[_T]]:
         try:
             while True:
                 yield self._next_raw_()
@@ -109,7 +313,7 @@ class Stream(Iterator[_T], Generic[_T]):
                 case _:
                     return e
 
-        self.__stack.append(w)
+        self.__push(w, "filter", key)
         return self
 
     def filterout(self, key: Callable[[_T], bool]) -> Stream[_T]:
@@ -125,7 +329,7 @@ class Stream(Iterator[_T], Generic[_T]):
                 case _:
                     return e
 
-        self.__stack.append(w)
+        self.__push(w, "filterout", key)
         return self
 
     def stop(self, key: Callable[[_T], bool]) -> Stream[_T]:
@@ -141,7 +345,7 @@ class Stream(Iterator[_T], Generic[_T]):
                 case _:
                     return e
 
-        self.__stack.append(w)
+        self.__push(w, "stop", key)
         return self
 
     def stopafter(self, key: Callable[[_T], bool]) -> Stream[_T]:
@@ -157,7 +361,7 @@ class Stream(Iterator[_T], Generic[_T]):
                 case _:
                     return e
 
-        self.__stack.append(w)
+        self.__push(w, "stopafter", key)
         return self
 
     def limit(self, num: int) -> Stream[_T]:
@@ -176,7 +380,7 @@ class Stream(Iterator[_T], Generic[_T]):
                     case _:
                         return e
 
-        self.__stack.append(w(num))
+        self.__push(w(num), "limit", num)
         return self
 
     take = limit
@@ -197,7 +401,7 @@ class Stream(Iterator[_T], Generic[_T]):
                     case _:
                         return e
 
-        self.__stack.append(w(num))
+        self.__push(w(num), "skip", num)
         return self
 
     def eval(self, func: Callable[[_T], _R]) -> Stream[_R]:
@@ -211,7 +415,7 @@ class Stream(Iterator[_T], Generic[_T]):
                 case _:
                     return e  # type: ignore
 
-        self.__stack.append(w)
+        self.__push(w, "eval", func)
         return self  # type: ignore
 
     map = eval
@@ -219,7 +423,7 @@ class Stream(Iterator[_T], Generic[_T]):
     def evr(
         self, funcraw: Callable[[StreamResult[_T]], StreamResult[_R]]
     ) -> Stream[_R]:
-        self.__stack.append(funcraw)
+        self.__push(funcraw)
         return self  # type: ignore
 
     def exc(
@@ -238,7 +442,7 @@ class Stream(Iterator[_T], Generic[_T]):
                 case _:
                     return e
 
-        self.__stack.append(w)
+        self.__push(w, "exc", exct, todo)
         return self
 
     def excg(
@@ -265,14 +469,17 @@ class Stream(Iterator[_T], Generic[_T]):
                         return e
             return e
 
-        self.__stack.append(w)
+        self.__push(w, "excg", exct, todo)
         return self
 
     @property
     def unique(self):
+        return self.uniquein(set[_T]())
+
+    def uniquein(self, cache: MutableSet[_T] | BloomFilter) -> Stream[_T]:
         class w:
             def __init__(self) -> None:
-                self.cache = set[_T]()
+                self.cache = cache
 
             def __call__(self, e: StreamResult[_T]) -> StreamResult[_T]:
                 match e:
@@ -284,14 +491,17 @@ class Stream(Iterator[_T], Generic[_T]):
                     case _:
                         return e
 
-        self.__stack.append(w())
+        self.__push(w(), "unique")
         return self
 
     @property
     def duplicates(self):
+        return self.duplicatesin(dict[_T, int]())
+
+    def duplicatesin(self, cache: MutableMapping[_T, int]) -> Stream[_T]:
         class w:
             def __init__(self) -> None:
-                self.cache = dict[_T, int]()
+                self.cache = cache
 
             def __call__(self, e: StreamResult[_T]) -> StreamResult[_T]:
                 match e:
@@ -306,13 +516,13 @@ class Stream(Iterator[_T], Generic[_T]):
                     case _:
                         return e
 
-        self.__stack.append(w())
+        self.__push(w(), "duplicates")
         return self
 
-    def uniqueret(self, func: Callable[[_T], Any]):
+    def uniqueret(self, func: Callable[[_T], Any], cache: MutableSet[Any] | BloomFilter | None = None):
         class w:
             def __init__(self) -> None:
-                self.cache = set()
+                self.cache = set() if cache is None else cache
 
             def __call__(self, e: StreamResult[_T]) -> StreamResult[_T]:
                 match e:
@@ -328,13 +538,15 @@ class Stream(Iterator[_T], Generic[_T]):
                     case _:
                         return e
 
-        self.__stack.append(w())
+        self.__push(w(), "uniqueret", func)
         return self
 
-    def collisions(self, func: Callable[[_T], _R]) -> Stream[tuple[tuple[_T, _T], _R]]:
+    def collisions(
+        self, func: Callable[[_T], _R], cache: MutableMapping[_R, _T] | None = None
+    ) -> Stream[tuple[tuple[_T, _T], _R]]:
         class w:
             def __init__(self) -> None:
-                self.cache = dict[_R, _T]()
+                self.cache = dict[_R, _T]() if cache is None else cache
 
             def __call__(
                 self, e: StreamResult[_T]
@@ -353,7 +565,7 @@ class Stream(Iterator[_T], Generic[_T]):
                     case _:
                         return StreamResult(((e.val, None), None), e.exc, e.flw)  # type: ignore
 
-        self.__stack.append(w())
+        self.__push(w(), "collisions", func)
         return self  # type: ignore
 
     def call(self, func: Callable[..., _R]) -> Stream[_R]:
@@ -375,7 +587,7 @@ class Stream(Iterator[_T], Generic[_T]):
                 case _:
                     return e  # type: ignore
 
-        self.__stack.append(w)
+        self.__push(w, "call", func)
         return self  # type: ignore
 
     def act(self, func: Callable[[_T], Any]) -> Stream[_T]:
@@ -391,10 +603,84 @@ class Stream(Iterator[_T], Generic[_T]):
                     return e  # type: ignore
                 # This error makes no sense
 
-        self.__stack.append(w)
+        self.__push(w, "act", func)
+        return self
+
+    def pmap(
+        self,
+        func: Callable[[_T], _R],
+        workers: int | None = None,
+        chunksize: int = 1,
+        ordered: bool = True,
+        window: int | None = None,
+    ) -> Stream[_R]:
+        if chunksize < 1:
+            raise ValueError("The chunk size must be at least 1")
+        workers = workers or os.cpu_count() or 1
+        self.__rebase(
+            partial(
+                mapped,
+                func=func,
+                executor=partial(ProcessPoolExecutor, workers),
+                window=window or 2 * workers,
+                chunksize=chunksize,
+                ordered=ordered,
+                pickled=True,
+            ),
+            "pmap",
+            func,
+        )
+        return self  # type: ignore
+
+    def tmap(
+        self,
+        func: Callable[[_T], _R],
+        workers: int | None = None,
+        ordered: bool = True,
+        window: int | None = None,
+    ) -> Stream[_R]:
+        workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.__rebase(
+            partial(
+                mapped,
+                func=func,
+                executor=partial(ThreadPoolExecutor, workers),
+                window=window or 2 * workers,
+                chunksize=1,
+                ordered=ordered,
+            ),
+            "tmap",
+            func,
+        )
+        return self  # type: ignore
+
+    def sorted(
+        self, key: Callable[[_T], Any] | None = None, reverse: bool = False, limit: int | None = None
+    ) -> Stream[_T]:
+        if limit is not None and limit < 0:
+            raise ValueError("The limit must not be negative")
+        self.__rebase(partial(ordered, key=key, reverse=reverse, limit=limit), "sorted", key)
+        return self
+
+    def sort(
+        self,
+        key: Callable[[_T], Any] | None = None,
+        reverse: bool = False,
+        memory_limit: int = 256 << 20,
+        dir: str | None = None,
+    ) -> Stream[_T]:
+        if memory_limit < 1:
+            raise ValueError("The memory limit must be positive")
+        self.__rebase(
+            partial(external, key=key, reverse=reverse, memory_limit=memory_limit, dir=dir), "sort", key
+        )
         return self
 
     def reduce(self, func: Callable[[_T, _T], _T], defaultvalue: _D = None) -> _T | _D:
+        chunks = self.__cleanchunks()
+        if chunks is not None:
+            ufunc = _numpy.reducer(func) if self.__backend == "numpy" else None
+            return _numpy.reduce(func, ufunc, chunks, defaultvalue)
         try:
             res = next(self)
         except StopIteration:
@@ -436,10 +722,99 @@ class Stream(Iterator[_T], Generic[_T]):
     def none(self) -> bool:
         return not any(self)
 
+    def __counted(self) -> int | None:
+        # On an increasing source every stop, stopafter and limit stage keeps a
+        # prefix, so the count is the shortest of the prefixes they allow.
+        counter = self.__counter
+        if counter is None or not self.__spec:
+            return None
+        num: int | None = None
+        for s in self.__spec:
+            match s:
+                case ("limit", n):
+                    c = max(n, 0)
+                case ("stop" | "stopafter" as op, key):
+                    # Elm comparisons go through the int dunder methods, which do
+                    # not compare ints with floats, so only int bounds qualify.
+                    match comparison(key):
+                        case ("gt", int() as x):
+                            c = counter(x)
+                        case ("ge", int() as x):
+                            c = counter(x - 1)
+                        case _:
+                            return None
+                    c += op == "stopafter"
+                case _:
+                    return None
+            num = c if num is None else min(num, c)
+        return num
+
     @property
     def count(self) -> int:
+        if (num := self.__counted()) is not None:
+            self.__stop()
+            return num
+        chunks = self.__cleanchunks()
+        if chunks is not None:
+            return sum(map(len, chunks))
         return sum(1 for _ in self)
 
+    def __aggregate(self, *accs: Any) -> None:
+        _aggregate.aggregate(accs, self, self.__cleanchunks())
+
+    def aggregate(self, **specs: str | tuple[Any, ...]) -> dict[str, Any]:
+        accs = {name: _aggregate.accumulator(spec) for name, spec in specs.items()}
+        self.__aggregate(*accs.values())
+        return {name: acc.result() for name, acc in accs.items()}
+
+    @property
+    def sum(self) -> Any:
+        acc = _aggregate.accumulator("sum")
+        self.__aggregate(acc)
+        return acc.result()
+
+    def __extreme(self, name: str, key: Callable[[_T], Any] | None, default: Any) -> Any:
+        acc = _aggregate.accumulator((name, key))
+        self.__aggregate(acc)
+        if acc.empty:
+            if default is _NODEFAULT:
+                raise ValueError(f"{name}() of an empty stream")
+            return default
+        return acc.result()
+
+    def min(self, key: Callable[[_T], Any] | None = None, default: Any = _NODEFAULT) -> Any:
+        return self.__extreme("min", key, default)
+
+    def max(self, key: Callable[[_T], Any] | None = None, default: Any = _NODEFAULT) -> Any:
+        return self.__extreme("max", key, default)
+
+    def __top(self, k: int, key: Callable[[_T], Any] | None, largest: bool) -> list[_T]:
+        acc = _aggregate.accumulator(("topk" if largest else "bottomk", k, key))
+        chunks = self.__cleanchunks()
+        if chunks is None:
+            return acc.pick(k, self, key=key)
+        _aggregate.aggregate((acc,), self, chunks)
+        return acc.result()
+
+    def topk(self, k: int, key: Callable[[_T], Any] | None = None) -> list[_T]:
+        return self.__top(k, key, True)
+
+    def bottomk(self, k: int, key: Callable[[_T], Any] | None = None) -> list[_T]:
+        return self.__top(k, key, False)
+
+    @property
+    def mean(self) -> float:
+        return self.aggregate(mean="mean")["mean"]
+
+    def var(self, ddof: int = 1) -> float:
+        return self.aggregate(var=("var", ddof))["var"]
+
+    def stddev(self, ddof: int = 1) -> float:
+        return self.aggregate(stddev=("stddev", ddof))["stddev"]
+
+    def quantiles(self, qs: Iterable[float], k: int = 200) -> list[Any]:
+        return self.aggregate(q=("quantiles", qs, k))["q"]
+
     def groupby(self, func: Callable[[_T], _R]) -> dict[_R, list[_T]]:
         ret = dict[_R, list[_T]]()
         for val in self:
@@ -477,7 +852,7 @@ class Stream(Iterator[_T], Generic[_T]):
                     case _:
                         return e
 
-        self.__stack.append(w())
+        self.__push(w(), "stalin")
         return self  # type: ignore
 
 
@@ -517,7 +892,7 @@ class streammeta(type):
 
     @property
     def primes(self) -> Stream[int]:
-        return Stream(primes())
+        return Stream(primes(), counter=primepi)
 
 
 class stream(metaclass=streammeta):
@@ -593,6 +968,10 @@ class stream(metaclass=streammeta):
     def randint(a: int, b: int) -> Stream[int]:
         return Stream((randint(a, b) for _ in count()))
 
+    @staticmethod
+    def aiter(__iter: AsyncIterable[_T] | Iterable[_T]) -> AsyncStream[_T]:
+        return AsyncStream(__iter)
+
 
 def null(__iter: Iterable[Any]) -> None:
     for _ in __iter:
@@ -12,8 +12,15 @@ from typing import (
     overload,
     SupportsIndex,
     Any,
+    AsyncIterable,
+    MutableMapping,
+    MutableSet,
 )
 
+from ..structs.caches import BloomFilter
+from ._async import AsyncStream
+from ._profile import Profile
+
 class _SFlow(Enum):
     NORM = 0
     SKIP = 1
@@ -29,6 +36,7 @@ _T4 = TypeVar("_T4")
 _T5 = TypeVar("_T5")
 _R = TypeVar("_R")
 _F = TypeVar("_F")
+_D = TypeVar("_D")
 
 class StreamResult(NamedTuple, Generic[_T]):
     val: _T
@@ -39,6 +47,60 @@ class Stream(Iterator[_T], Generic[_T]):
     def __init__(self, __iter: Iterable[_T]): ...
     def __iter__(self) -> Iterator[_T]: ...
     def __next__(self) -> _T: ...
+    def compile(self) -> Stream[_T]:
+        """
+        Fuses every run of consecutive built-in stages into a single generated
+        function, removing the per-stage dispatch from the element loop. The
+        stream compiles itself when the first element is requested, and again if
+        new stages are added later, so calling this method is only needed to pay
+        the compilation cost upfront.
+        Streams built from an iterable whose stages are all among filter,
+        filterout, stop, stopafter, eval, act, limit, skip and unique skip the
+        StreamResult wrapping entirely and run on the plain values, only falling
+        back to a StreamResult for the elements that raise an exception.
+        """
+    def batched(
+        self, num: int, backend: Literal["python", "numpy"] = "python"
+    ) -> Stream[_T]:
+        """
+        Switches the stream to chunked execution: the source is read num elements
+        at a time and every stage processes the whole chunk in a single call,
+        amortising the per-element overhead. The returned elements, the limit and
+        stop cutoffs and the exception handling are the same as in the default
+        mode, but the source may be read up to num - 1 elements past a cutoff, and
+        the stages of a pipeline no longer interleave their calls element by
+        element. Stages added after the iteration started apply from the next
+        chunk on.
+        With the numpy backend, chunks of plain ints or floats are converted to
+        arrays: eval, filter, filterout, stop and stopafter stages built from elm
+        expressions run as array operations, and count and reduce with add, mul,
+        min or max work on whole arrays. Any other stage, and any chunk the
+        expression fails on, goes through the Python path, which is also used
+        when NumPy is not installed. Integer results that could overflow 64 bits
+        are computed by the Python path instead, so they match the default mode,
+        while floating point results may differ in the last digit.
+        """
+    def profile(self) -> Stream[_T]:
+        """
+        Turns on the per stage instrumentation: every stage counts the elements
+        entering and leaving it, skipped, stopping the stream or raising, and
+        times each of them. The stages then run one by one instead of through the
+        fused or batched engines, so the whole pipeline is slower, but unprofiled
+        streams pay nothing. The look-ahead stages, pmap, tmap, sorted and sort,
+        are timed as a whole, less the time of the stages before them. Setting
+        the QUICKAG_PROFILE environment variable before the import profiles
+        every stream and prints each report to stderr when it stops, or when it
+        is collected if it never does. Streams that are the source of another
+        stream, as in robin or zip, do not print a report of their own.
+        ss = stream.range(100).filter(elm % 3).eval(elm * 2).profile()
+        ss.null; print(ss.report)
+        """
+    @property
+    def report(self) -> Profile | None:
+        """
+        The report of a profiled stream, or None if it is not profiled: a Profile
+        holding the StageStats of each stage, which prints as a table.
+        """
     def filter(self, key: Callable[[_T], bool]) -> Stream[_T]:
         """
         Removes element when key(element) returns false, keeping all elements for
@@ -126,10 +188,22 @@ class Stream(Iterator[_T], Generic[_T]):
         """
         The method keeps a cache of all unique elements and returns only the first
         occurence of each element."""
-    def uniqueret(self, func: Callable[[_T], _R]) -> Stream[_T]:
+    def uniquein(self, cache: MutableSet[_T] | BloomFilter) -> Stream[_T]:
+        """
+        Same as unique, but keeps the seen elements in the given cache, which can
+        bound the memory used on long streams. With an LRUSet(n) from
+        quickAg.structs.caches, an element is only dropped if it was seen among
+        the last n distinct elements. With a BloomFilter(capacity, fprate), the
+        memory is fixed and elements never seen before are dropped with at most
+        probability fprate. The footprint can be read from cache.nbytes.
+        stream.randint(0, 10**9).uniquein(LRUSet(10**6))"""
+    def uniqueret(
+        self, func: Callable[[_T], _R], cache: MutableSet[_R] | BloomFilter | None = None
+    ) -> Stream[_T]:
         """
         The function keeps a cache of all return values for func and returns only
-        the first element that return a specific value."""
+        the first element that return a specific value. A bounded cache can be
+        given as in uniquein."""
     @property
     def duplicates(self) -> Stream[_T]:
         """
@@ -137,10 +211,78 @@ class Stream(Iterator[_T], Generic[_T]):
         once, if a new element is already present in the cache. The elements may
         be out of order.
         stream((0,1,2,2,0,3,0,4,2)).duplicates) -> (2, 0)"""
-    def collisions(self, func: Callable[[_T], _R]) -> Stream[tuple[tuple[_T, _T], _R]]:
+    def duplicatesin(self, cache: MutableMapping[_T, int]) -> Stream[_T]:
+        """
+        Same as duplicates, but counts the elements in the given mapping, such as
+        an LRUDict(n) from quickAg.structs.caches to bound the memory used. An
+        element evicted from the cache can be returned again."""
+    def collisions(
+        self, func: Callable[[_T], _R], cache: MutableMapping[_R, _T] | None = None
+    ) -> Stream[tuple[tuple[_T, _T], _R]]:
         """
         The method keeps a cache of all results of the function func and returns
-        only the elements for which there was a collision of the output value."""
+        only the elements for which there was a collision of the output value. A
+        bounded mapping such as an LRUDict can be given as cache."""
+    def pmap(
+        self,
+        func: Callable[[_T], _R],
+        workers: int | None = None,
+        chunksize: int = 1,
+        ordered: bool = True,
+        window: int | None = None,
+    ) -> Stream[_R]:
+        """
+        Evaluates func on the elements of the stream in a pool of worker
+        processes, sending them chunksize at a time. At most window tasks are in
+        flight (twice the number of workers by default), so the stream is never
+        read far ahead of its consumer. With ordered=False the results are
+        returned as soon as they are ready. Exceptions raised by func, and the
+        pickling errors of func or of the elements, are returned to the stream
+        and can be handled with exc and excg. func must be picklable, so lambdas
+        and local functions cannot be used, while elm expressions can.
+        stream.range(10).pmap(is_prime, workers=4).list
+        stream.range(10).pmap(elm * elm + 1, workers=4).list"""
+    def tmap(
+        self,
+        func: Callable[[_T], _R],
+        workers: int | None = None,
+        ordered: bool = True,
+        window: int | None = None,
+    ) -> Stream[_R]:
+        """
+        Evaluates func on the elements of the stream in a pool of threads, for
+        functions that spend their time waiting on I/O. At most window calls are
+        in flight (twice the number of workers by default), and the calls not yet
+        started are cancelled as soon as a later stage stops the stream. With
+        ordered=False the results are returned in completion order. Exceptions
+        raised by func can be handled with exc and excg.
+        stream(urls).tmap(fetch, workers=16).list"""
+    def sorted(
+        self, key: Callable[[_T], Any] | None = None, reverse: bool = False, limit: int | None = None
+    ) -> Stream[_T]:
+        """
+        Returns the elements of the stream in sorted order, as the builtin sorted,
+        once the previous stages are exhausted. With a limit only the first limit
+        elements of the order are kept, in a bounded heap. The elements raising
+        in the previous stages come first, and can be handled with exc and excg.
+        stream(records).sorted(key=elm.time, limit=10).list"""
+    def sort(
+        self,
+        key: Callable[[_T], Any] | None = None,
+        reverse: bool = False,
+        memory_limit: int = 256 << 20,
+        dir: str | None = None,
+    ) -> Stream[_T]:
+        """
+        Returns the elements of the stream in sorted order, as sorted, for streams
+        larger than the memory, holding about memory_limit bytes of elements.
+        Whenever the buffered elements exceed half of it they are sorted and
+        spilled, pickled, to a temporary file in dir, and the sorted runs are
+        merged lazily with heapq.merge, reading them back in batches that share
+        the other half. The size of the elements is estimated with getsizeof.
+        The elements must be picklable; the files are deleted when the stream
+        stops.
+        stream(open("huge.log")).sort(key=parse_time, memory_limit=1 << 30)"""
     def reduce(self, func: Callable[[_T, _T], _R]) -> _R:
         """
         Applies the given reduction function to the elements of the stream,
@@ -172,6 +314,52 @@ class Stream(Iterator[_T], Generic[_T]):
     def groupby(self, func: Callable[[_T], _R]) -> dict[_R, list[_T]]:
         """Groups the values of the stream into a dict of lists"""
     @property
+    def sum(self) -> _T:
+        """Sums the elements of the stream, returning 0 if it is empty."""
+    def min(self, key: Callable[[_T], Any] | None = None, default: _D = ...) -> _T | _D:
+        """
+        Returns the smallest element of the stream, as the builtin min: the
+        default if given and the stream is empty, else a ValueError is raised."""
+    def max(self, key: Callable[[_T], Any] | None = None, default: _D = ...) -> _T | _D:
+        """
+        Returns the largest element of the stream, as the builtin max: the
+        default if given and the stream is empty, else a ValueError is raised."""
+    def topk(self, k: int, key: Callable[[_T], Any] | None = None) -> list[_T]:
+        """
+        Returns the k largest elements of the stream, largest first, as
+        sorted(..., reverse=True)[:k] but in O(k) memory."""
+    def bottomk(self, k: int, key: Callable[[_T], Any] | None = None) -> list[_T]:
+        """
+        Returns the k smallest elements of the stream, smallest first, as
+        sorted(...)[:k] but in O(k) memory."""
+    @property
+    def mean(self) -> float:
+        """The mean of the elements of the stream, or nan if it is empty."""
+    def var(self, ddof: int = 1) -> float:
+        """
+        The variance of the elements of the stream, computed in a single pass with
+        Welford's algorithm. The sum of the squared deviations is divided by the
+        number of elements minus ddof: 1 gives the sample variance, as
+        statistics.variance, 0 the population variance. nan if there are no more
+        than ddof elements."""
+    def stddev(self, ddof: int = 1) -> float:
+        """The square root of the variance of the elements of the stream."""
+    def quantiles(self, qs: Iterable[float], k: int = 200) -> list[_T]:
+        """
+        The approximate values of the stream at the given quantiles, between 0
+        and 1, in bounded memory: the elements are summarized in a KLLSketch of
+        size k, whose rank error is about 1.7 / k. None for every quantile if the
+        stream is empty.
+        stream(latencies).quantiles([0.5, 0.99])"""
+    def aggregate(self, **specs: str | tuple[Any, ...]) -> dict[str, Any]:
+        """
+        Computes several aggregates of the stream in a single pass, returning
+        them in a dict under the given names. Each spec is the name of an
+        aggregate, or a tuple of the name and its arguments: "count", "sum",
+        "mean", ("min", key), ("max", key), ("var", ddof), ("stddev", ddof),
+        ("quantiles", qs, k), ("topk", k, key) and ("bottomk", k, key). min and max of an empty stream are None.
+        stream(data).aggregate(n="count", avg="mean", sd="stddev", p=("quantiles", [0.5, 0.9]))"""
+    @property
     def stalin(self) -> Stream[_T]:
         """
         Does a stalinsort of the elements, returning an element only if larger
@@ -244,7 +432,10 @@ class streammeta(type):
     def primes(self) -> Stream[int]:
         """
         This factory returns a stream of prime numbers in order. It uses the
-        iterator from quickAg.math.primes.
+        iterator from quickAg.math.primes. Counting a stream made only of stop,
+        stopafter and limit stages, with elm > n or elm >= n as keys for an int n,
+        uses primepi instead of generating the primes:
+        stream.primes.stop(elm > 10**9).count -> 50847534
         """
 
 class stream(metaclass=streammeta):
@@ -458,5 +649,13 @@ class stream(metaclass=streammeta):
         """
         The factory returns a stream of random integers in the range [a, b].
         """
+    @staticmethod
+    def aiter(__iter: AsyncIterable[_T] | Iterable[_T]) -> AsyncStream[_T]:
+        """
+        The factory returns an AsyncStream over an async or regular iterable, or
+        over a Stream, keeping its exceptions. Its stages accept coroutine
+        functions and its terminal operations must be awaited:
+        await stream.aiter(urls).amap(fetch, concurrency=16).list
+        """
 
 def null(__iter: Iterable[_T]) -> None: ...
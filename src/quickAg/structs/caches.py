@@ -0,0 +1,161 @@
+from __future__ import annotations
+from collections import OrderedDict
+from math import ceil, log
+from sys import getsizeof
+from typing import Hashable, Iterable, Iterator, MutableMapping, MutableSet, TypeVar
+
+_K = TypeVar("_K", bound=Hashable)
+_V = TypeVar("_V")
+
+_MASK64 = (1 << 64) - 1
+
+
+class LRUSet(MutableSet[_K]):
+    """A set holding at most maxsize elements. When full, adding a new element
+    evicts the least recently used one, where both adding an element and finding
+    it with `in` count as a use."""
+
+    def __init__(self, maxsize: int, iter: Iterable[_K] = ()) -> None:
+        if maxsize < 1:
+            raise ValueError("The maximum size must be at least 1")
+        self.maxsize = maxsize
+        self._data: OrderedDict[_K, None] = OrderedDict()
+        for v in iter:
+            self.add(v)
+
+    def __contains__(self, elm: object) -> bool:
+        if elm in self._data:
+            self._data.move_to_end(elm)  # type: ignore
+            return True
+        return False
+
+    def add(self, elm: _K) -> None:
+        self._data[elm] = None
+        self._data.move_to_end(elm)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def discard(self, elm: _K) -> None:
+        self._data.pop(elm, None)
+
+    def __iter__(self) -> Iterator[_K]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.maxsize}, {list(self._data)!r})"
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate memory footprint of the set and its elements."""
+        return getsizeof(self._data) + sum(map(getsizeof, self._data))
+
+
+class LRUDict(MutableMapping[_K, _V]):
+    """A dictionary holding at most maxsize keys. When full, setting a new key
+    evicts the least recently used one, where setting, getting and finding a key
+    with `in` count as a use."""
+
+    def __init__(self, maxsize: int) -> None:
+        if maxsize < 1:
+            raise ValueError("The maximum size must be at least 1")
+        self.maxsize = maxsize
+        self._data: OrderedDict[_K, _V] = OrderedDict()
+
+    def __contains__(self, key: object) -> bool:
+        if key in self._data:
+            self._data.move_to_end(key)  # type: ignore
+            return True
+        return False
+
+    def __getitem__(self, key: _K) -> _V:
+        val = self._data[key]
+        self._data.move_to_end(key)
+        return val
+
+    def __setitem__(self, key: _K, val: _V) -> None:
+        self._data[key] = val
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __delitem__(self, key: _K) -> None:
+        del self._data[key]
+
+    def __iter__(self) -> Iterator[_K]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.maxsize}, {dict(self._data)!r})"
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate memory footprint of the dictionary, its keys and values."""
+        return getsizeof(self._data) + sum(getsizeof(k) + getsizeof(v) for k, v in self._data.items())
+
+
+def _mix(h: int) -> int:
+    # splitmix64 finalizer: spreads the bits of hash(), which is the identity on
+    # small integers, over the whole 64 bit range.
+    h = (h ^ (h >> 30)) * 0xBF58476D1CE4E5B9 & _MASK64
+    h = (h ^ (h >> 27)) * 0x94D049BB133111EB & _MASK64
+    return h ^ (h >> 31)
+
+
+class BloomFilter:
+    """A probabilistic set of fixed size, sized to hold capacity elements with the
+    given false positive rate. `in` may return True for an element that was never
+    added, with at most that probability while the filter holds no more than
+    capacity elements, but never returns False for an element that was added.
+    Elements cannot be removed. The filter relies on hash(), so it is only
+    consistent within a single process."""
+
+    def __init__(self, capacity: int, fprate: float = 0.01) -> None:
+        if capacity < 1:
+            raise ValueError("The capacity must be at least 1")
+        if not 0 < fprate < 1:
+            raise ValueError("The false positive rate must be between 0 and 1")
+        self.capacity = capacity
+        self.fprate = fprate
+        self.nbits = max(8, ceil(-capacity * log(fprate) / log(2) ** 2))
+        self.nhashes = max(1, round(self.nbits / capacity * log(2)))
+        self._bits = bytearray((self.nbits + 7) // 8)
+        self._count = 0
+
+    def __indices(self, elm: Hashable) -> Iterator[int]:
+        h = hash(elm) & _MASK64
+        h1 = _mix(h)
+        h2 = _mix(h ^ 0x9E3779B97F4A7C15) | 1
+        m = self.nbits
+        return ((h1 + i * h2) % m for i in range(self.nhashes))
+
+    def __contains__(self, elm: Hashable) -> bool:
+        bits = self._bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self.__indices(elm))
+
+    def add(self, elm: Hashable) -> None:
+        bits = self._bits
+        new = False
+        for i in self.__indices(elm):
+            b = 1 << (i & 7)
+            if not bits[i >> 3] & b:
+                bits[i >> 3] |= b
+                new = True
+        self._count += new
+
+    def __len__(self) -> int:
+        """The number of distinct elements added, as far as the filter can tell."""
+        return self._count
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.capacity}, {self.fprate})"
+
+    @property
+    def nbytes(self) -> int:
+        """The memory footprint of the bit array, which is fixed at creation."""
+        return getsizeof(self._bits)
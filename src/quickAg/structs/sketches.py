@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from itertools import accumulate
+from math import ceil
+from random import Random
+from typing import Any, Iterable, Sequence
+
+
+class KLLSketch:
+    """An approximate quantile sketch (Karnin, Lang and Liberty), holding O(k) of
+    the values added to it whatever their number. The rank of the value returned
+    for a quantile is off by about 1.7 / k of the number of values, with high
+    probability. Values must be comparable with each other; seed makes the
+    random choices of the sketch reproducible."""
+
+    def __init__(self, k: int = 200, seed: int | None = None) -> None:
+        if k < 8:
+            raise ValueError("k must be at least 8")
+        self.k = k
+        self._rng = Random(seed)
+        # Level h holds values standing for 2**h values each.
+        self._levels: list[list[Any]] = [[]]
+        self._count = 0
+        self._size = 0
+        self._maxsize = self.__capacity(0)
+
+    def __capacity(self, h: int) -> int:
+        # The top level holds k values, each level below 2/3 of the one above.
+        return int(ceil(self.k * (2 / 3) ** (len(self._levels) - h - 1))) + 1
+
+    def add(self, val: Any) -> None:
+        self._levels[0].append(val)
+        self._count += 1
+        self._size += 1
+        if self._size >= self._maxsize:
+            self.__compress()
+
+    def update(self, vals: Iterable[Any]) -> None:
+        for v in vals:
+            self.add(v)
+
+    def __compress(self) -> None:
+        # Compacts the lowest full level: its values are sorted and every other
+        # one, from a random offset, moves up a level with twice the weight.
+        for h in range(len(self._levels)):
+            level = self._levels[h]
+            if len(level) < self.__capacity(h):
+                continue
+            if h + 1 == len(self._levels):
+                self._levels.append([])
+                self._maxsize = sum(map(self.__capacity, range(len(self._levels))))
+            level.sort()
+            last = level.pop() if len(level) & 1 else None
+            self._levels[h + 1].extend(level[self._rng.getrandbits(1) :: 2])
+            level.clear()
+            if last is not None:
+                level.append(last)
+            self._size = sum(map(len, self._levels))
+            if self._size < self._maxsize:
+                return
+
+    def merge(self, other: KLLSketch) -> None:
+        """Adds the values summarized by another sketch."""
+        while len(self._levels) < len(other._levels):
+            self._levels.append([])
+        for mine, theirs in zip(self._levels, other._levels):
+            mine.extend(theirs)
+        self._count += other._count
+        self._maxsize = sum(map(self.__capacity, range(len(self._levels))))
+        self._size = sum(map(len, self._levels))
+        while self._size >= self._maxsize:
+            self.__compress()
+
+    def __weighted(self) -> tuple[list[Any], list[int]]:
+        items = sorted((v, 1 << h) for h, level in enumerate(self._levels) for v in level)
+        return [v for v, _ in items], list(accumulate(w for _, w in items))
+
+    def quantiles(self, qs: Sequence[float]) -> list[Any]:
+        """The approximate values at the given quantiles, between 0 and 1."""
+        if any(not 0 <= q <= 1 for q in qs):
+            raise ValueError("The quantiles must be between 0 and 1")
+        if not self._count:
+            raise ValueError("The sketch is empty")
+        vals, cum = self.__weighted()
+        total = cum[-1]
+        return [vals[min(bisect_left(cum, q * total), len(vals) - 1)] for q in qs]
+
+    def quantile(self, q: float) -> Any:
+        return self.quantiles((q,))[0]
+
+    def rank(self, val: Any) -> float:
+        """The approximate fraction of the values less than or equal to val."""
+        if not self._count:
+            raise ValueError("The sketch is empty")
+        vals, cum = self.__weighted()
+        i = bisect_left(vals, val)
+        while i < len(vals) and not val < vals[i]:
+            i += 1
+        return cum[i - 1] / cum[-1] if i else 0.0
+
+    def __len__(self) -> int:
+        """The number of values added to the sketch."""
+        return self._count
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.k}, count={self._count}, retained={self._size})"
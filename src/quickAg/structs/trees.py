@@ -50,10 +50,10 @@ class BinaryTreeNode(Generic[_T]):
 
     @left.setter
     def left(self, val: _T):
-        if self.left is None:
-            self.children = BinaryTreeNode(val), self.right
+        if self.children[0] is None:
+            self.children = BinaryTreeNode(val), self.children[1]
         else:
-            self.left.value = val
+            self.children[0].value = val
 
     @property
     def right(self):
@@ -63,10 +63,10 @@ class BinaryTreeNode(Generic[_T]):
 
     @right.setter
     def right(self, val: _T):
-        if self.right is None:
-            self.children = self.left, BinaryTreeNode(val)
+        if self.children[1] is None:
+            self.children = self.children[0], BinaryTreeNode(val)
         else:
-            self.right.value = val
+            self.children[1].value = val
 
 
 class BinaryTree(Generic[_T]):
@@ -1,12 +1,138 @@
+import concurrent.futures
+import threading
+import time
+
 try:
-    from src.quickAg.math.primes import primes, is_prime
+    from src.quickAg.math.primes import (
+        PrimeFile,
+        build,
+        cache,
+        is_prime,
+        is_prime_many,
+        load,
+        nth_prime,
+        primefac,
+        primefac_dict,
+        primepi,
+        primes,
+        unload,
+    )
 except ModuleNotFoundError:
-    from quickAg.math.primes import primes, is_prime
+    from quickAg.math.primes import (
+        PrimeFile,
+        build,
+        cache,
+        is_prime,
+        is_prime_many,
+        load,
+        nth_prime,
+        primefac,
+        primefac_dict,
+        primepi,
+        primes,
+        unload,
+    )
 
 
 def test_is_prime():
     assert is_prime(7919)
+    assert not any(map(is_prime, (4, 9, 25, 561, 3215031751, 3825123056546413051)))
+    assert is_prime(2**61 - 1) and is_prime(2**127 - 1)
+    assert not is_prime((2**61 - 1) * (2**89 - 1))
+    assert [n for n in range(100) if is_prime(n)] == [*primes(100)]
+    big = range(4001**2, 4001**2 + 100)
+    assert [is_prime(float(n)) for n in big] == [is_prime(n) for n in big]
+    assert is_prime(7.0) and not is_prime(7.5) and not is_prime(2.0**80)
+
+
+def test_is_prime_many():
+    assert is_prime_many([]) == []
+    dense = range(10**6, 10**6 + 1000)
+    assert is_prime_many(dense) == [is_prime(n) for n in dense]
+    sparse = [1, 2, 9, 7919, 2**61 - 1, 3215031751, -7]
+    assert is_prime_many(sparse) == [is_prime(n) for n in sparse]
+    assert is_prime_many([0, 1, 2, 3, 4, 5.0]) == [False, False, True, True, False, True]
+    # Dense but large values are tested one by one rather than sieved.
+    large = range(10**16, 10**16 + 50)
+    t = time.perf_counter()
+    assert is_prime_many(large) == [is_prime(n) for n in large]
+    assert time.perf_counter() - t < 1
 
 
 def test_primes():
     assert [2, 3, 5, 7, 11, 13, 17, 19] == [*primes(20)]
+
+
+def test_primes_sieve(monkeypatch):
+    assert sum(1 for _ in primes(10**6)) == 78498
+    assert [*primes(3)] == [2] and [*primes(2)] == []
+    gen = primes()
+    assert [next(gen) for _ in range(10)] == [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]
+    assert [*primes(5 * 10**6 + 1, workers=2)] == [*primes(5 * 10**6 + 1)]
+    assert [*primes(30, workers=2)] == [*primes(30)] and [*primes(2, workers=2)] == []
+    # Ranges of at most one segment per worker are sieved without a pool.
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", None)
+    assert sum(1 for _ in primes(2 * 10**6, workers=2)) == 148933
+
+
+def test_primefac():
+    assert primefac(1) == [1]
+    assert primefac(360) == [1, 2, 2, 2, 3, 3, 5]
+    assert primefac(1000003 * 999983) == [1, 999983, 1000003]
+    assert primefac((2**31 - 1) ** 2 * 7) == [1, 7, 2**31 - 1, 2**31 - 1]
+    assert primefac_dict(360) == {2: 3, 3: 2, 5: 1}
+
+
+def test_prime_cache():
+    cache.clear()
+    assert cache.reserve(1000) and len(cache) == 168 and cache.limit == 1000
+    assert 997 in cache and 999 not in cache and is_prime(997)
+    cache.maxbytes, maxbytes = 400, cache.maxbytes
+    try:
+        cache.clear()
+        assert not cache.reserve(10**6) and len(cache) == 100 and cache.limit == 542
+        assert sum(1 for _ in primes(10**5)) == 9592
+    finally:
+        cache.maxbytes = maxbytes
+        cache.clear()
+
+    # Readers racing with clear() see either the old or the new table, whole.
+    done = threading.Event()
+
+    def clearing() -> None:
+        while not done.is_set():
+            cache.reserve(10**5)
+            cache.clear()
+
+    t = threading.Thread(target=clearing)
+    t.start()
+    try:
+        for _ in range(200):
+            assert is_prime(99991) and nth_prime(1000) == 7919 and primepi(99991) == 9592
+    finally:
+        done.set()
+        t.join()
+
+
+def test_prime_file(tmp_path):
+    build(10**5, tmp_path / "primes.bin", workers=2)
+    with PrimeFile(tmp_path / "primes.bin") as f:
+        assert f.limit == 10**5 and f.count() == 9592
+        assert [*f.primes()] == [*primes(10**5)]
+        assert [*f.primes(10, 30)] == [11, 13, 17, 19, 23, 29] and f.count(10, 30) == 6
+        assert 99991 in f and 99993 not in f
+    first = load(tmp_path / "primes.bin")
+    try:
+        second = load(tmp_path / "primes.bin")
+        assert first._mm.closed and not second._mm.closed
+        assert is_prime(99991) and primepi(10**5 - 1) == 9592
+    finally:
+        unload()
+    assert second._mm.closed
+
+
+def test_primepi():
+    assert [primepi(x) for x in (-1, 0, 1, 2, 3, 10, 100)] == [0, 0, 0, 1, 2, 4, 25]
+    assert primepi(10**9) == 50847534
+    assert [nth_prime(n) for n in (1, 2, 5, 6, 25)] == [2, 3, 11, 13, 97]
+    assert nth_prime(10**6) == 15485863
@@ -1,7 +1,38 @@
+import asyncio
+import copy
+import gc
+import math
+import pickle
+import random
+import statistics
+import tempfile
+
+try:
+    from src.quickAg.streams import stream, elm, even, odd, log, log2
+except ModuleNotFoundError:
+    from quickAg.streams import stream, elm, even, odd, log, log2
+
+try:
+    from src.quickAg.streams import _profile
+    from src.quickAg.streams._elm import Elm
+except ModuleNotFoundError:
+    from quickAg.streams import _profile
+    from quickAg.streams._elm import Elm
+
 try:
-    from src.quickAg.streams import stream, elm, even, odd
+    from src.quickAg.structs.caches import BloomFilter, LRUDict, LRUSet
 except ModuleNotFoundError:
-    from quickAg.streams import stream, elm, even, odd
+    from quickAg.structs.caches import BloomFilter, LRUDict, LRUSet
+
+try:
+    from src.quickAg.structs.sketches import KLLSketch
+except ModuleNotFoundError:
+    from quickAg.structs.sketches import KLLSketch
+
+try:
+    from src.quickAg.math.primes import is_prime
+except ModuleNotFoundError:
+    from quickAg.math.primes import is_prime
 
 
 class ZeroError(Exception):
@@ -18,6 +49,46 @@ def test_stream():
     assert list(stream.n0.limit(5)) == [0, 1, 2, 3, 4]
 
 
+def test_elm():
+    ex = (elm * 2 + 1) % elm > 0
+    assert ex.ev is ex.ev and [ex(x) for x in (1, 2, 3)] == [False, True, True]
+    assert (elm.a + elm["b"])({"a": 1, "b": 2}) == 3 and (10 - elm)(4) == 6
+    assert log2(elm * 4)(2) == 3.0 and log(elm, 2)(8) == 3.0 and log(8, elm)(2) == 3.0
+    assert list(stream.n0.limit(6).filter(elm % 3 > 0).eval(elm * elm)) == [1, 4, 16, 25]
+
+
+def test_elm_optimize():
+    calls = []
+    rec = {"a": 3, "b": 4}
+    ex = (elm.a + elm.a) * elm.a + elm.b * elm.b
+    assert ex(rec) == 34 and ex.ev.__code__.co_varnames == ("x", "_t0", "_t1")
+    counted = Elm(lambda x: calls.append(x) or x)
+    assert (counted + counted)(2) == 4 and calls == [2, 2]
+    assert ((log2(elm) * 1 - 0) ** 1)(8) == 3.0 and (log2(elm).__neg__().__neg__())(8) == 3.0
+    assert (elm + 0.5)(1) is NotImplemented and (elm - elm + 1)(2) == 1
+    assert str((elm * 1.0)(-0.0)) == "-0.0" and str((log2(elm) * -1 + 0)(1)) == "0.0"
+    # The identities on floats are removed from the generated code.
+    for ex in ((log2(elm) * 1 - 0) ** 1, -(-log2(elm)), +log2(elm) / 1.0):
+        assert ex.ev.__code__.co_code == log2(elm).ev.__code__.co_code
+
+
+def test_elm_pickle():
+    ex = pickle.loads(pickle.dumps((elm.a + elm.a) * log2(elm.b) > 5.0))
+    assert ex({"a": 1.0, "b": 8}) and not ex({"a": 0.5, "b": 8})
+    assert pickle.loads(pickle.dumps(elm > 3)).ev(4) and copy.deepcopy(elm * 2)(4) == 8
+    assert stream.range(8).pmap(elm * elm + 1, workers=2, chunksize=3).list == [1, 2, 5, 10, 17, 26, 37, 50]
+
+
+def test_elm_vectorize():
+    ex = (elm * 2 + 1) % 7 > 3
+    assert [bool(v) for v in ex.vectorize(range(8))] == [ex(v) for v in range(8)]
+    assert [float(v) for v in log2(elm + 1).vectorize([0, 1, 3])] == [0.0, 1.0, 2.0]
+    assert [float(v) for v in log(8, elm).vectorize([2, 8])] == [3.0, 1.0]
+    assert list((elm.a + 1).vectorize([{"a": 1}, {"a": 2}])) == [2, 3]
+    assert [int(v) for v in ((elm % 64) << (elm % 64)).vectorize([2**62 + 60])] == [60 << 60]
+    assert stream.range(1, 20).filter(log2(elm) > 3).batched(8, "numpy").list == [*range(9, 20)]
+
+
 def test_filter():
     assert list(stream.n0.limit(8).filter(even)) == [0, 2, 4, 6]
     assert list(stream.n0.limit(8).filterout(odd)) == [0, 2, 4, 6]
@@ -36,6 +107,16 @@ def test_unique():
     assert list(stream.n0.eval(elm // 3).limit(10).unique) == [0, 1, 2, 3]
 
 
+def test_uniquein():
+    ss = stream((1, 2, 3, 1, 4, 5, 1, 2, 6, 2)).uniquein(LRUSet(3))
+    assert ss.list == [1, 2, 3, 4, 5, 2, 6]
+    bloom = BloomFilter(1000, 0.001)
+    assert stream((0, 1, 2, 0, 3, 1) * 100).uniquein(bloom).list == [0, 1, 2, 3]
+    assert len(bloom) == 4 and bloom.nbytes < 2000
+    ss = stream((0, 1, 2, 2, 0, 3, 0, 4, 2)).duplicatesin(LRUDict(2))
+    assert ss.list == [2, 0]
+
+
 def test_uniqueret():
     assert list(stream.n0.limit(5).uniqueret(elm // 3)) == [0, 3]
 
@@ -159,5 +240,248 @@ def test_count():
     assert stream.n0.limit(5).count == 5
 
 
+def test_aggregate():
+    data = [3, 1, 4, 1, 5, 9, 2, 6]
+    for batch in (None, "python", "numpy"):
+        mk = (lambda: stream(data)) if batch is None else (lambda: stream(data).eval(elm * 1).batched(3, batch))  # type: ignore
+        assert mk().sum == 31
+        assert mk().min() == 1 and mk().max() == 9
+        assert abs(mk().mean - statistics.mean(data)) < 1e-12
+        assert abs(mk().var() - statistics.variance(data)) < 1e-12
+        assert abs(mk().stddev(0) - statistics.pstdev(data)) < 1e-12
+        res = mk().aggregate(n="count", lo=("min", lambda x: -x), p=("quantiles", [0, 0.5, 1]))
+        assert res == {"n": 8, "lo": 9, "p": [1, 3, 9]}
+    assert stream(["bb", "a", "ccc", "dd"]).max(key=len) == "ccc"
+    assert stream([]).min(default=None) is None and stream([]).sum == 0
+    assert math.isnan(stream([]).mean) and math.isnan(stream([1]).var())
+    assert stream([]).aggregate(hi="max", p=("quantiles", [0.5])) == {"hi": None, "p": [None]}
+    try:
+        stream([]).max()
+        assert False
+    except ValueError:
+        pass
+
+
+def test_topk():
+    data = [5, 1, 8, 3, 9, 2, 8, 7]
+    for batch in (None, "python", "numpy"):
+        mk = (lambda: stream(data)) if batch is None else (lambda: stream(data).eval(elm * 1).batched(3, batch))  # type: ignore
+        assert mk().topk(3) == [9, 8, 8]
+        assert mk().bottomk(2) == [1, 2]
+        assert mk().topk(0) == [] and mk().bottomk(20) == sorted(data)
+        assert mk().sorted().list == sorted(data)
+        assert mk().sorted(reverse=True, limit=2).list == [9, 8]
+        assert mk().aggregate(t=("topk", 2), b=("bottomk", 1)) == {"t": [9, 8], "b": [1]}
+    pairs = [(i % 3, i) for i in range(200)]
+    assert stream(pairs).topk(3, key=lambda p: p[0]) == [(2, 2), (2, 5), (2, 8)]
+    assert stream(pairs).sorted(key=lambda p: p[0], limit=2).list == [(0, 0), (0, 3)]
+    assert stream([2, 0, 1]).eval(2 / elm).sorted().exc(ZeroDivisionError).list == [1.0, 2.0]
+
+
+def test_sort():
+    data = [(i * 7919 % 101, i) for i in range(2000)]
+    for limit in (1, 5000, 1 << 20):
+        assert stream(data).sort(key=lambda p: p[0], memory_limit=limit).list == sorted(data, key=lambda p: p[0])
+    assert stream(data).sort(reverse=True, memory_limit=5000).list == sorted(data, reverse=True)
+    ss = stream.range(10_000).eval(-elm).sort(memory_limit=1000)
+    assert ss.limit(3).list == [-9999, -9998, -9997]
+    assert stream([2, 0, 1]).eval(2 / elm).sort(memory_limit=1).exc(ZeroDivisionError).list == [1.0, 2.0]
+    big = ["%06d" % (i * 7919 % 1000) + "x" * 20_000 for i in range(200)]
+    assert stream(big).sort(memory_limit=100_000).list == sorted(big)
+
+
+def test_sort_cleanup(monkeypatch):
+    opened = []
+    temporary = tempfile.TemporaryFile
+
+    def tracked(*args, **kwargs):
+        opened.append(temporary(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(tempfile, "TemporaryFile", tracked)
+    ss = stream.range(10_000).eval(-elm).sort(memory_limit=1000)
+    assert ss.limit(3).list == [-9999, -9998, -9997]
+    assert opened and all(f.closed for f in opened)
+    assert stream.range(5000).sort(memory_limit=1).count == 5000
+    assert all(f.closed for f in opened)
+
+
+def test_kll():
+    data = list(range(100_000))
+    random.Random(1).shuffle(data)
+    sketch = KLLSketch(200, seed=2)
+    sketch.update(data)
+    assert len(sketch) == 100_000
+    for q, v in zip((0.1, 0.5, 0.99), sketch.quantiles((0.1, 0.5, 0.99))):
+        assert abs(v / 100_000 - q) < 0.02
+    assert abs(sketch.rank(25_000) - 0.25) < 0.02
+    other = KLLSketch(200, seed=3)
+    other.update(range(100_000, 200_000))
+    sketch.merge(other)
+    assert len(sketch) == 200_000 and abs(sketch.quantile(0.5) / 200_000 - 0.5) < 0.02
+    assert abs(stream(data).quantiles([0.9])[0] / 100_000 - 0.9) < 0.02
+
+
 def test_skip():
     assert stream.n0.skip(5).limit(5).list == [5, 6, 7, 8, 9]
+
+
+def test_compile():
+    ss = stream.n0.filter(odd).eval(x0).exc(ZeroError).limit(4).compile()
+    assert ss.list == [1, 3, 5, 7]
+    ss = stream.n0.limit(6).eval(lambda x: x - 2).eval(x0).evr(lambda e: e).exc(ZeroError)
+    assert ss.list == [-2, -1, 1, 2, 3]
+    for ss in (stream.range(6).eval(elm * 2), stream.range(6).eval(elm * 2).batched(4)):
+        it = iter(ss)
+        assert it is ss and next(ss) == 0 and next(it) == 2 and ss.list == [4, 6, 8, 10]
+
+
+def test_plain_exc():
+    ss = stream.range(4).eval(lambda x: x - 1).eval(x0)
+    assert next(ss) == -1
+    try:
+        next(ss)
+    except RuntimeError as e:
+        assert isinstance(e.args[0].exc, ZeroError)
+    assert ss.list == [1, 2]
+
+
+def test_batched():
+    ss = stream.n0.filterout(elm % 3).stopafter(elm > 8).batched(4)
+    assert ss.list == [0, 3, 6, 9]
+    ss = stream.n0.limit(8).eval(lambda x: x - 3).eval(x0).exc(ZeroError).skip(1).batched(3)
+    assert ss.list == [-2, -1, 1, 2, 3, 4]
+    ss = stream.cat(stream.n1.limit(4).eval(x0), stream.n0.limit(3).eval(x0)).batched(2)
+    assert ss.exc(ZeroError).list == [1, 2, 3, 4, 1, 2]
+    ss = stream.range(10**4, 10**4 + 200).filter(is_prime).batched(64)
+    assert ss.list == [n for n in range(10**4, 10**4 + 200) if is_prime(n)]
+    assert stream((2, 3.0, 4, 7, 9.0)).filterout(is_prime).batched(2).list == [4, 9.0]
+
+
+def test_batched_numpy():
+    ss = stream.range(20).eval(elm * 3 - 1).filter(elm % 2).stop(elm > 40).batched(4, "numpy")
+    assert ss.list == [-1, 5, 11, 17, 23, 29, 35]
+    ss = stream.range(5).eval(1 / (elm - 2)).exc(ZeroDivisionError).batched(8, "numpy")
+    assert ss.list == [-0.5, -1.0, 1.0, 0.5]
+    assert stream.range(10).filter(even).batched(3, "numpy").reduce(int.__add__) == 20
+    assert stream.range(10).filter(elm > 3).batched(3, "numpy").count == 6
+    assert stream.range(100).filter(is_prime).batched(16, "numpy").count == 25
+    # Int results that do not fit in 64 bits take the Python path.
+    assert stream([3, 2**62, 2**62]).batched(64, "numpy").eval(elm * 4).list == [12, 2**64, 2**64]
+    assert stream([3, 2**40]).eval(elm + 0).batched(64, "numpy").eval(elm * 2**30 // 2**30).list == [3, 2**40]
+    assert stream([2**62, 2**62]).eval(elm + 0).batched(64, "numpy").sum == 2**63
+    big = [5, 2**62 + 60, 2**62 + 1023]
+    for ex in ((elm % 64) << (elm % 64), (elm % 1024) ** 7, elm // 3 * 8):
+        assert stream(big).batched(4, "numpy").eval(ex).list == stream(big).eval(ex).list
+
+
+def test_profile():
+    ss = stream.range(20).filterout(elm % 3 == 1).eval(x0).exc(ZeroError).stopafter(elm > 10).profile()
+    assert ss.list == [2, 3, 5, 6, 8, 9, 11] and ss.report is not None
+    names = [st.name for st in ss.report.stages]
+    assert names == ["0 filterout(elm)", "1 eval(x0)", "2 exc(ZeroError, 'skip')", "3 stopafter(elm)"]
+    counts = [(st.ein, st.out, st.skipped, st.stopped, st.raised) for st in ss.report.stages]
+    assert counts == [(12, 8, 4, 0, 0), (8, 7, 0, 0, 1), (8, 7, 1, 0, 0), (7, 7, 0, 1, 0)]
+    assert sum(ss.report.stages[0].hist) == 12 and "filterout(elm)" in str(ss.report)
+    ss = stream.range(-3, 6).filter(elm % 3).tmap(x0, workers=2).exc(ZeroError).profile().batched(2)
+    assert ss.list == [-2, -1, 1, 2, 4, 5]
+    assert [st.name for st in ss.report.stages] == ["0 filter(elm)", "1 tmap(x0)", "2 exc(ZeroError, 'skip')"]
+    assert ss.report.stages[1].out == 6
+    ss = stream.range(5).eval(x0).sorted().exc(ZeroError).profile()
+    assert ss.list == [1, 2, 3, 4]
+    assert [st.name for st in ss.report.stages] == ["0 eval(x0)", "1 sorted(None)", "2 exc(ZeroError, 'skip')"]
+    assert ss.report.stages[1].raised == 1
+    assert stream.range(3).report is None
+
+
+def test_profile_report(monkeypatch, capsys):
+    monkeypatch.setattr(_profile, "ENABLED", True)
+    ss = stream.robin(stream.range(3).eval(elm + 1), stream.range(3)).tmap(abs, workers=2).filter(elm > 1)
+    assert ss.list == [2, 3, 2]
+    err = capsys.readouterr().err
+    assert err.count("stage") == 1 and "tmap(abs)" in err
+    ss = stream.n0.eval(elm * 2)
+    assert next(ss) == 0
+    assert capsys.readouterr().err == ""
+    del ss
+    gc.collect()
+    assert "eval(elm)" in capsys.readouterr().err
+
+
+def test_pmap():
+    ss = stream.range(-3, 4).pmap(x0, workers=2, chunksize=2).exc(ZeroError)
+    assert ss.list == [-3, -2, -1, 1, 2, 3]
+    ss = stream.range(-3, 4).pmap(x0, workers=2, ordered=False).exc(ZeroError)
+    assert sorted(ss.list) == [-3, -2, -1, 1, 2, 3]
+    assert stream.n1.pmap(x0, workers=2).limit(3).list == [1, 2, 3]
+    # A run of failing elements is not read ahead of the consumer.
+    pulled: list[int] = []
+    ss = stream.n0.act(pulled.append).eval(lambda x: 1 // 0 if x < 20000 else x).pmap(abs, workers=2)
+    try:
+        next(ss)
+    except RuntimeError:
+        pass
+    assert len(pulled) <= 8
+
+
+def test_tmap():
+    ss = stream.range(-3, 4).tmap(x0, workers=3).exc(ZeroError)
+    assert ss.list == [-3, -2, -1, 1, 2, 3]
+    ss = stream.range(-3, 4).tmap(lambda x: x * 2, ordered=False)
+    assert sorted(ss.list) == [-6, -4, -2, 0, 2, 4, 6]
+    assert stream.n1.tmap(x0, workers=2, window=2).limit(3).list == [1, 2, 3]
+    pulled: list[int] = []
+    for ordered in (True, False):
+        pulled.clear()
+        ss = stream.n0.act(pulled.append).eval(lambda x: 1 // 0 if x < 20000 else x)
+        ss = ss.tmap(abs, workers=2, ordered=ordered)
+        try:
+            next(ss)
+        except RuntimeError:
+            pass
+        assert len(pulled) <= 4
+
+
+def test_aiter():
+    async def double(x: int) -> int:
+        await asyncio.sleep(0)
+        return x0(x) * 2
+
+    def group(x: int) -> int:
+        if not x:
+            raise ExceptionGroup("group", [ZeroError()])
+        return x
+
+    async def main():
+        ss = stream.aiter(range(-3, 4)).eval(double).exc(ZeroError)
+        assert await ss.list == [-6, -4, -2, 2, 4, 6]
+        ss = stream.aiter(range(-3, 4)).amap(double, concurrency=3).exc(ZeroError)
+        assert await ss.limit(4).list == [-6, -4, -2, 2]
+        ss = stream.aiter(range(10)).amap(double, ordered=False).filter(elm > 5)
+        assert sorted(await ss.exc(ZeroError).list) == [6, 8, 10, 12, 14, 16, 18]
+        assert await stream.aiter(range(5)).reduce(int.__add__) == 10
+        # A run of failing elements is not read ahead of the consumer.
+        for ordered in (True, False):
+            pulled: list[int] = []
+            ss = stream.aiter(range(20010)).act(pulled.append).eval(lambda x: 1 // 0 if x < 20000 else x)
+            ss = ss.amap(double, concurrency=3, ordered=ordered)
+            try:
+                await ss.__anext__()
+            except RuntimeError:
+                pass
+            assert len(pulled) <= 4
+        ss = stream.aiter(range(3)).eval(group).excg(ZeroError)
+        assert await ss.list == [1, 2]
+        ss = stream.aiter(range(3)).eval(group).excg(ExceptionGroup, "stop")
+        sync = stream(range(3)).eval(group).excg(ExceptionGroup, "stop")
+        assert await ss.exc(ExceptionGroup).list == sync.exc(ExceptionGroup).list
+
+    asyncio.run(main())
+
+
+def test_primes_count():
+    assert stream.primes.stop(elm > 1000).count == 168
+    assert stream.primes.stopafter(elm >= 997).limit(200).count == 168
+    ss = stream.primes.stop(elm > 100)
+    next(ss)
+    assert ss.count == 24
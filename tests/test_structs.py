@@ -0,0 +1,21 @@
+try:
+    from src.quickAg.structs.trees import BinaryTree, BinaryTreeNode
+except ModuleNotFoundError:
+    from quickAg.structs.trees import BinaryTree, BinaryTreeNode
+
+
+def test_binarytree():
+    tree = BinaryTree[int]()
+    assert tree.is_empty()
+    for i in range(10):
+        tree.insert(i)
+    assert [node.value for node in tree._traversewidth()] == list(range(10))
+    assert tree.root.left.left.value == 3
+    assert tree.root.right.left.value == 5
+    assert tree._getlastnode().value == 9
+
+    node = BinaryTreeNode(0)
+    node.right = 2
+    node.left = 1
+    node.left = 3
+    assert (node.left.value, node.right.value) == (3, 2)